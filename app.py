@@ -1,142 +1,125 @@
 import os
-import sqlite3
 import json
+import base64
+import gzip
+import hashlib
+import datetime
+import itertools
 from flask import Flask, render_template, request, jsonify
-from process_data import process_data
+try:
+    import brotli
+except ImportError:  # Responses are gzip-compressed only
+    brotli = None
+import jobs
+import db_utils
+import process_bmi
+import export
+import query_cache
+import settings_store
 
 app = Flask(__name__)
 
-# Default settings using values from process_data_new.py
-DEFAULT_SETTINGS = {
-    'import_cut_date': '20250101',  # Default to January 1, 2025
-    'auth_file_path': 'auth.yml',  # Default authentication file
-    'statistics': 'wpi'  # Default statistics type
-}
-
+DB_PATH = 'bmi_data.db'
 
-def initialize_settings():
-    """Initialize the settings table if it doesn't exist"""
-    conn = sqlite3.connect('bmi_data.db')
-    cursor = conn.cursor()
+# Filter sets whose row count is kept in termin_stats, by the stored column
+STATS_COUNTS = {
+    (): 'total',
+    ('import_found',): 'missing',
+    ('rejected_import_found',): 'rejected',
+    ('ok',): 'ok',
+}
+STATS_COLUMNS = ('total', 'missing', 'rejected', 'ok')
 
-    # Create settings table if it doesn't exist
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS settings (
-        key TEXT PRIMARY KEY,
-        value TEXT
-    )
-    ''')
-
-    # Check if settings already exist
-    cursor.execute("SELECT COUNT(*) FROM settings")
-    count = cursor.fetchone()[0]
-
-    # If no settings exist, insert defaults
-    if count == 0:
-        for key, value in DEFAULT_SETTINGS.items():
-            cursor.execute("INSERT INTO settings (key, value) VALUES (?, ?)", (key, value))
-    else:
-        # Make sure both required settings exist
-        cursor.execute("SELECT key FROM settings")
-        existing_keys = [row[0] for row in cursor.fetchall()]
+# Number of id2s looked up per statement by update_entries
+BULK_LOOKUP_CHUNK_SIZE = 500
 
-        for key, value in DEFAULT_SETTINGS.items():
-            if key not in existing_keys:
-                cursor.execute("INSERT INTO settings (key, value) VALUES (?, ?)", (key, value))
+# JSON responses smaller than this are sent uncompressed
+COMPRESS_MIN_SIZE = 1024
 
-    conn.commit()
-    conn.close()
+# Columns the dashboard can sort by
+SORT_COLUMNS = ('datei', 'erstellt', 'melder_id', 'typ', 'import_found', 'rejected_import_found', 'ok', 'id2')
 
 
-def get_settings():
-    """Get all settings from the database"""
-    conn = sqlite3.connect('bmi_data.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+def get_table_prefix(statistics):
+    """Get the table prefix based on statistics type"""
+    return "BMI_EMISO" if statistics == "emiso" else "BMI"
 
-    cursor.execute("SELECT key, value FROM settings")
-    rows = cursor.fetchall()
 
-    settings = {}
-    for row in rows:
-        settings[row['key']] = row['value']
+def get_termin_catalog(statistics='wpi'):
+    """Get the catalog entries of all termins, most recent first"""
+    with db_utils.sqlite_connection(DB_PATH) as conn:
+        rows = conn.execute("SELECT termin, row_count, last_refresh, refresh_duration, source_watermark "
+                            "FROM termin_catalog WHERE statistics = ? ORDER BY termin DESC", (statistics,)).fetchall()
 
-    # Ensure all settings exist with non-empty values
-    for key, default_value in DEFAULT_SETTINGS.items():
-        if key not in settings or not settings[key]:
-            settings[key] = default_value
+    return [{key: row[key] for key in row.keys()} for row in rows]
 
-    conn.close()
-    return settings
 
+def get_termins(statistics='wpi'):
+    """Get all available termins from the database"""
+    return [entry['termin'] for entry in get_termin_catalog(statistics)]
 
-def update_settings(new_settings):
-    """Update settings in the database"""
-    conn = sqlite3.connect('bmi_data.db')
-    cursor = conn.cursor()
 
-    for key, value in new_settings.items():
-        cursor.execute("UPDATE settings SET value = ? WHERE key = ?", (value, key))
+def get_clean_termin(termin, statistics='wpi'):
+    """Ensure termin doesn't already include the prefix"""
+    if statistics == 'emiso' and termin.startswith('_EMISO'):
+        return termin[6:]  # Remove _EMISO prefix if present
+    return termin
 
-    conn.commit()
-    conn.close()
-    return True
 
+def get_bmi_source(conn, termin, statistics='wpi'):
+    """Get the table and WHERE clauses holding the rows of a termin, see db_utils.bmi_source"""
+    return db_utils.bmi_source(conn, get_clean_termin(termin, statistics), statistics)
 
-def get_table_prefix(statistics):
-    """Get the table prefix based on statistics type"""
-    return "BMI_EMISO" if statistics == "emiso" else "BMI"
 
+def encode_cursor(row, sort_by):
+    """Build the opaque pagination cursor of a row from its sort value and id2"""
+    position = json.dumps([row[sort_by], row['id2']])
+    return base64.urlsafe_b64encode(position.encode()).decode()
 
-def get_termins(statistics='wpi'):
-    """Get all available termins from the database"""
-    conn = sqlite3.connect('bmi_data.db')
-    cursor = conn.cursor()
 
-    # Get table prefix based on statistics type
-    if statistics == 'emiso':
-        # For EMISO, get tables that start with BMI_EMISO
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'BMI\\_EMISO%' ESCAPE '\\'")
-        tables = cursor.fetchall()
-        prefix = "BMI_EMISO"
-    else:
-        # For WPI, get tables that start with BMI but NOT BMI_EMISO
-        cursor.execute(
-            "SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'BMI%' AND name NOT LIKE 'BMI\\_EMISO%' ESCAPE '\\'")
-        tables = cursor.fetchall()
-        prefix = "BMI"
+def decode_cursor(cursor):
+    """Get the (sort value, id2) position of a cursor, raises ValueError if it is malformed"""
+    try:
+        value, id2 = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    if not isinstance(value, (str, int, float, type(None))) or not isinstance(id2, str):
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    return value, id2
 
-    termins = []
-    for table in tables:
-        termin = table[0].replace(prefix, '')
-        termins.append(termin)
 
-    conn.close()
-    return sorted(termins, reverse=True)  # Most recent first
+def seek_clause(sort_by, position, forward):
+    """
+    Build the WHERE clause for the rows after (forward) or before a position in ascending order.
 
+    Ties on the sort column are broken by id2. NULLs sort first, so they get
+    their own branch next to the row value comparison.
+    """
+    value, id2 = position
+    if value is None:
+        if forward:
+            return f"(({sort_by} IS NULL AND id2 > ?) OR {sort_by} IS NOT NULL)", [id2]
+        return f"({sort_by} IS NULL AND id2 < ?)", [id2]
+    if forward:
+        return f"({sort_by}, id2) > (?, ?)", [value, id2]
+    return f"({sort_by} IS NULL OR ({sort_by}, id2) < (?, ?))", [value, id2]
 
-def get_data_for_termin(termin, statistics='wpi', page=1, page_size=20, sort_by='datei', sort_order='asc',
-                        filters=None):
-    """Get data for a specific termin with pagination, sorting and filtering"""
-    conn = sqlite3.connect('bmi_data.db')
-    conn.row_factory = sqlite3.Row  # This enables column access by name
-    cursor = conn.cursor()
 
-    # Ensure termin doesn't already include the prefix
-    clean_termin = termin
-    if statistics == 'emiso' and termin.startswith('_EMISO'):
-        clean_termin = termin[6:]  # Remove _EMISO prefix if present
+def get_search_columns(conn, source, filters):
+    """Get the filtered columns whose substring filter is looked up in the search index"""
+    return [column for column, value in (filters or {}).items()
+            if column in db_utils.BMI_FTS_COLUMNS and value
+            and db_utils.bmi_fts_is_selective(conn, source.table, column, value)]
 
-    table_prefix = get_table_prefix(statistics)
-    table_name = f"{table_prefix}{clean_termin}"
 
-    # Start building the query
-    query = f"SELECT * FROM {table_name}"
-    params = []
+def filter_clauses(source, filters, search_columns=()):
+    """Get the WHERE clauses and parameters selecting the rows of a termin that match the filters"""
+    table_name = source.table
+    where_clauses = list(source.where)
+    params = list(source.params)
 
-    # Apply filters if any
+    # Apply filters if any; the quick filter clauses match the partial indexes in db_utils.BMI_INDEXES
     if filters:
-        where_clauses = []
         for column, value in filters.items():
             if column == 'import_found' and value.lower() == 'false':
                 where_clauses.append(f"({column} IS NULL OR {column} = 0)")
@@ -144,63 +127,189 @@ def get_data_for_termin(termin, statistics='wpi', page=1, page_size=20, sort_by=
                 where_clauses.append(f"{column} = 1")
             elif column == 'ok' and value.lower() == 'true':
                 where_clauses.append(f"{column} = 1")
+            elif column in search_columns:
+                where_clauses.append(f"rowid IN (SELECT rowid FROM {table_name}_fts WHERE {table_name}_fts MATCH ?)")
+                params.append(db_utils.bmi_fts_match(column, value))
             elif value:
-                where_clauses.append(f"{column} LIKE ?")
-                params.append(f"%{value}%")
+                clause, param = db_utils.bmi_like_filter(column, value)
+                where_clauses.append(clause)
+                params.append(param)
+    return where_clauses, params
+
+
+def build_data_query(source, page=1, page_size=20, sort_by='datei', sort_order='asc', filters=None,
+                     after=None, before=None, search_columns=(), columns=None):
+    """
+    Build the page query and the count query for the rows of a termin.
+
+    Pages are addressed by number (OFFSET) or, if after or before holds a
+    (sort value, id2) position, by seeking from that position, which reads
+    the page from the index however deep it is. A page before a position is
+    queried in reverse order and has to be reversed by the caller. Substring
+    filters on search_columns are looked up in the table's trigram index.
+    columns limits the page query to validated column names, else all are read.
+    source is the db_utils.BmiSource of the termin; its clauses come first,
+    so in entries storage mode the indexes on (statistics, termin, ...) apply.
+
+    Returns:
+        tuple: (query, query params, count query, count params)
+    """
+    if sort_by not in SORT_COLUMNS or sort_order not in ('asc', 'desc'):
+        raise ValueError(f"Invalid sort {sort_by} {sort_order}")
+
+    # Start building the query
+    table_name = source.table
+    query = f"SELECT {', '.join(columns) if columns else '*'} FROM {table_name}"
+    where_clauses, params = filter_clauses(source, filters, search_columns)
+
+    # Get total count (without pagination)
+    count_query = f"SELECT COUNT(*) FROM {table_name}"
+    if where_clauses:
+        count_query += " WHERE " + " AND ".join(where_clauses)
 
-        if where_clauses:
-            query += " WHERE " + " AND ".join(where_clauses)
+    query_params = list(params)
+    order = sort_order
+    position = after or before
+    if position:
+        # Rows after the position in descending order come before it in ascending order
+        forward = (sort_order == 'asc') == (after is not None)
+        clause, seek_params = seek_clause(sort_by, position, forward)
+        where_clauses.append(clause)
+        query_params += seek_params
+        if before is not None:
+            order = 'desc' if sort_order == 'asc' else 'asc'
 
-    # Apply sorting
-    if sort_by:
-        query += f" ORDER BY {sort_by} {sort_order}"
+    if where_clauses:
+        query += " WHERE " + " AND ".join(where_clauses)
+
+    # Apply sorting, id2 keeps the order stable for rows with the same sort value
+    query += f" ORDER BY {sort_by} {order}, id2 {order}"
 
     # Add pagination
-    offset = (page - 1) * page_size
-    query += f" LIMIT {page_size} OFFSET {offset}"
+    query += f" LIMIT {page_size}"
+    if not position:
+        query += f" OFFSET {(page - 1) * page_size}"
+
+    return query, query_params, count_query, params
+
+
+def get_data_for_termin(termin, statistics='wpi', page=1, page_size=20, sort_by='datei', sort_order='asc',
+                        filters=None, after=None, before=None, columns=None, columnar=False):
+    """
+    Get data for a specific termin with pagination, sorting and filtering.
+
+    after and before are cursors returned as next_cursor/prev_cursor by a
+    previous call; with one of them the page after or before that row is
+    returned instead of the page number. columns restricts the rows to
+    those columns. With columnar the rows are returned as lists under
+    'rows' with their column names once under 'columns', instead of a
+    list of dicts under 'data'.
+    """
+    with db_utils.sqlite_connection(DB_PATH) as conn:
+        return read_data_page(conn, termin, statistics, page, page_size, sort_by, sort_order, filters, after, before,
+                              columns, columnar)
+
+
+def read_data_page(conn, termin, statistics='wpi', page=1, page_size=20, sort_by='datei', sort_order='asc',
+                   filters=None, after=None, before=None, columns=None, columnar=False):
+    """Read a page of a termin and its filtered total on the given connection, see get_data_for_termin"""
+    after = decode_cursor(after) if after else None
+    before = decode_cursor(before) if before else None
+
+    source = get_bmi_source(conn, termin, statistics)
+    query_columns = None
+    if columns:
+        table_columns = {row[1] for row in conn.execute(f"PRAGMA table_info({source.table})")}
+        unknown = [column for column in columns if column not in table_columns]
+        if unknown:
+            raise ValueError(f"Invalid columns {', '.join(unknown)}")
+        # The cursors are built from the sort column and id2
+        query_columns = list(dict.fromkeys([*columns, sort_by, 'id2']))
+    search_columns = get_search_columns(conn, source, filters)
+    query, query_params, count_query, params = build_data_query(
+        source, page, page_size, sort_by, sort_order, filters, after, before, search_columns, query_columns)
+
+    cursor = conn.cursor()
 
     # Execute the query
-    cursor.execute(query, params)
+    cursor.execute(query, query_params)
     rows = cursor.fetchall()
+    if before:
+        rows.reverse()
 
-    # Convert rows to dictionaries
-    result = []
-    for row in rows:
-        result.append({key: row[key] for key in row.keys()})
+    # Convert rows to lists or dictionaries of the requested columns
+    result_columns = list(columns) if columns else [column[0] for column in cursor.description or ()]
+    if columnar:
+        result = {'columns': result_columns, 'rows': [[row[key] for key in result_columns] for row in rows]}
+    else:
+        result = {'data': [{key: row[key] for key in result_columns} for row in rows]}
+
+    # Unfiltered and quick filter counts are kept up to date in termin_stats
+    stats = None
+    stats_column = STATS_COUNTS.get(tuple(sorted(filters or {})))
+    if stats_column:
+        stats = db_utils.get_termin_stats(conn, get_clean_termin(termin, statistics), statistics)
+    if stats is not None:
+        total_count = sum(row[2 + STATS_COLUMNS.index(stats_column)] for row in stats)
+    else:
+        cursor.execute(count_query, params)
+        total_count = cursor.fetchone()[0]
 
-    # Get total count (without pagination)
-    count_query = f"SELECT COUNT(*) FROM {table_name}"
-    if filters and where_clauses:
-        count_query += " WHERE " + " AND ".join(where_clauses)
+    return {
+        **result,
+        'total': total_count,
+        'next_cursor': encode_cursor(rows[-1], sort_by) if rows else None,
+        'prev_cursor': encode_cursor(rows[0], sort_by) if rows else None
+    }
 
-    cursor.execute(count_query, params)
-    total_count = cursor.fetchone()[0]
 
-    conn.close()
+def get_index_report(termin, statistics='wpi'):
+    """Get the indexes of a termin's table and the query plans of the dashboard views"""
+    views = {
+        'all': None,
+        'missing': {'import_found': 'false'},
+        'rejected': {'rejected_import_found': 'true'},
+        'ok': {'ok': 'true'},
+        'search': {'melder_id': 'abc'},
+    }
+
+    # A pooled connection could return a cached plan from before the indexes existed
+    conn = db_utils.connect_sqlite(DB_PATH)
+    try:
+        source = get_bmi_source(conn, termin, statistics)
+        indexes = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name = ? ORDER BY name", (source.table,))]
+
+        plans = {}
+        for view, filters in views.items():
+            search_columns = ['melder_id'] if view == 'search' else []
+            query, query_params, count_query, params = build_data_query(
+                source, filters=filters, search_columns=search_columns)
+            seek_query, seek_params, _, _ = build_data_query(
+                source, filters=filters, after=('', ''), search_columns=search_columns)
+            plans[view] = {
+                'page': db_utils.explain_query_plan(conn, query, query_params),
+                'next_page': db_utils.explain_query_plan(conn, seek_query, seek_params),
+                'count': db_utils.explain_query_plan(conn, count_query, params)
+            }
+    finally:
+        conn.close()
 
     return {
-        'data': result,
-        'total': total_count
+        'table': source.table,
+        'indexes': indexes,
+        'plans': plans
     }
 
 
 def get_entry_details(termin, id2, statistics='wpi'):
     """Get details for a specific entry"""
-    conn = sqlite3.connect('bmi_data.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
-    # Ensure termin doesn't already include the prefix
-    clean_termin = termin
-    if statistics == 'emiso' and termin.startswith('_EMISO'):
-        clean_termin = termin[6:]  # Remove _EMISO prefix if present
-
-    table_prefix = get_table_prefix(statistics)
-    table_name = f"{table_prefix}{clean_termin}"
-    query = f"SELECT * FROM {table_name} WHERE id2 = ?"
-
-    cursor.execute(query, (id2,))
-    row = cursor.fetchone()
+    with db_utils.sqlite_connection(DB_PATH) as conn:
+        source = get_bmi_source(conn, termin, statistics)
+        query = f"SELECT * FROM {source.table}{db_utils.where_clause(source.where + ['id2 = ?'])}"
+        cursor = conn.cursor()
+        cursor.execute(query, (*source.params, id2))
+        row = cursor.fetchone()
 
     if row:
         # Convert to dictionary
@@ -208,69 +317,352 @@ def get_entry_details(termin, id2, statistics='wpi'):
     else:
         result = None
 
-    conn.close()
     return result
 
 
 def update_entry(termin, id2, comment, ok, statistics='wpi'):
     """Update the comment and ok fields for an entry"""
-    conn = sqlite3.connect('bmi_data.db')
-    cursor = conn.cursor()
+    with db_utils.sqlite_connection(DB_PATH) as conn:
+        source = get_bmi_source(conn, termin, statistics)
+        where = db_utils.where_clause(source.where + ['id2 = ?'])
+        # Take the write lock first, so the old ok value cannot change before the stats are adjusted
+        conn.execute('BEGIN IMMEDIATE')
+        old = conn.execute(f"SELECT ok, typ, institutstyp FROM {source.table}{where}", (*source.params, id2)).fetchone()
+        conn.execute(f"UPDATE {source.table} SET comment = ?, ok = ?{where}", (comment, ok, *source.params, id2))
+        if old is not None:
+            db_utils.adjust_termin_stats(conn, get_clean_termin(termin, statistics), statistics,
+                                         old['typ'], old['institutstyp'], ok=(ok == 1) - (old['ok'] == 1))
+            db_utils.bump_data_version(conn, get_clean_termin(termin, statistics), statistics)
 
-    # Ensure termin doesn't already include the prefix
-    clean_termin = termin
-    if statistics == 'emiso' and termin.startswith('_EMISO'):
-        clean_termin = termin[6:]  # Remove _EMISO prefix if present
+    return True
 
-    table_prefix = get_table_prefix(statistics)
-    table_name = f"{table_prefix}{clean_termin}"
-    query = f"UPDATE {table_name} SET comment = ?, ok = ? WHERE id2 = ?"
 
-    cursor.execute(query, (comment, ok, id2))
-    conn.commit()
-    conn.close()
+def ok_flag(ok):
+    """Convert an ok value of a request to 1, 0 or None, raises ValueError unless it is a boolean, 0 or 1"""
+    if ok is None:
+        return None
+    if not isinstance(ok, int) or ok not in (0, 1):
+        raise ValueError(f"Invalid ok value {ok!r}. Must be true, false, 0 or 1")
+    return int(ok)
+
+
+def check_comment(comment):
+    """Check a comment value of a request, raises ValueError unless it is a string or None"""
+    if comment is not None and not isinstance(comment, str):
+        raise ValueError(f"Invalid comment {comment!r}. Must be a string")
+    return comment
+
+
+def update_entries(termin, statistics='wpi', entries=None, filters=None, comment=None, ok=None):
+    """
+    Update the comment and ok fields of many entries in one transaction.
+
+    Either entries lists {'id2', 'comment', 'ok'} dicts and each row gets
+    its own values, or filters selects the rows like /api/data and all of
+    them get comment and ok. A field that is missing or None keeps its
+    value. The stored statistics are adjusted by the ok changes of each
+    typ/institutstyp group.
+
+    Args:
+        termin (str): Termin (YYYYMM)
+        statistics (str): Statistics type, 'wpi' or 'emiso'
+        entries (list): Per-row changes
+        filters (dict): Filters as for get_data_for_termin, at least one
+        comment (str): Comment for all filtered rows
+        ok (bool): OK status for all filtered rows
+
+    Returns:
+        int: Number of rows updated
+
+    Raises:
+        ValueError: If entries or a comment or ok value is malformed
+    """
+    if entries is None and not filters:
+        raise ValueError("A bulk update needs entries or filters")
+    if entries is not None:
+        if not isinstance(entries, list) or not all(isinstance(entry, dict) for entry in entries):
+            raise ValueError("entries must be a list of objects")
+        if any('id2' not in entry for entry in entries):
+            raise ValueError("Every entry needs an id2")
+        changes = [(check_comment(entry.get('comment')), ok_flag(entry.get('ok')), str(entry['id2']))
+                   for entry in entries]
+    else:
+        comment, new_ok = check_comment(comment), ok_flag(ok)
+
+    with db_utils.sqlite_connection(DB_PATH) as conn:
+        source = get_bmi_source(conn, termin, statistics)
+        clean_termin = get_clean_termin(termin, statistics)
+        # Take the write lock first, so the old ok values cannot change before the stats are adjusted
+        conn.execute('BEGIN IMMEDIATE')
+
+        ok_changes = {}
+        if entries is not None:
+            old_rows = {}
+            for start in range(0, len(changes), BULK_LOOKUP_CHUNK_SIZE):
+                id2s = [id2 for _, _, id2 in changes[start:start + BULK_LOOKUP_CHUNK_SIZE]]
+                where = db_utils.where_clause(source.where + [f"id2 IN ({', '.join(['?'] * len(id2s))})"])
+                for row in conn.execute(f"SELECT id2, ok, typ, institutstyp FROM {source.table}{where}",
+                                        (*source.params, *id2s)):
+                    old_rows[row['id2']] = row
+            for _, new_ok, id2 in changes:
+                old = old_rows.get(id2)
+                if old is not None and new_ok is not None:
+                    group = (old['typ'] or '', old['institutstyp'] or '')
+                    ok_changes[group] = ok_changes.get(group, 0) + (new_ok == 1) - (old['ok'] == 1)
+                    # A later change of the same row starts from this one
+                    old_rows[id2] = {**old, 'ok': new_ok}
+
+            where = db_utils.where_clause(source.where + ['id2 = ?'])
+            conn.executemany(f"UPDATE {source.table} SET comment = COALESCE(?, comment), ok = COALESCE(?, ok){where}",
+                             [(new_comment, new_ok, *source.params, id2) for new_comment, new_ok, id2 in changes])
+            updated = len({id2 for _, _, id2 in changes if id2 in old_rows})
+        else:
+            clauses, params = filter_clauses(source, filters, get_search_columns(conn, source, filters))
+            where = db_utils.where_clause(clauses)
+            if new_ok is not None:
+                for row in conn.execute(f"SELECT COALESCE(typ, '') AS typ, COALESCE(institutstyp, '') AS institutstyp, "
+                                        f"COUNT(*) AS total, COUNT(*) FILTER (WHERE ok = 1) AS ok "
+                                        f"FROM {source.table}{where} GROUP BY 1, 2", params):
+                    ok_changes[(row['typ'], row['institutstyp'])] = (row['total'] if new_ok else 0) - row['ok']
+            updated = conn.execute(f"UPDATE {source.table} SET comment = COALESCE(?, comment), "
+                                   f"ok = COALESCE(?, ok){where}", (comment, new_ok, *params)).rowcount
+
+        for (typ, institutstyp), change in ok_changes.items():
+            db_utils.adjust_termin_stats(conn, clean_termin, statistics, typ, institutstyp, ok=change)
+        if updated:
+            db_utils.bump_data_version(conn, clean_termin, statistics)
+
+    return updated
+
+
+def get_termin_changes(termin, statistics='wpi'):
+    """Get the rows changed by the last incremental refresh of a termin"""
+    with db_utils.sqlite_connection(DB_PATH) as conn:
+        cursor = conn.cursor()
+
+        # The change log only exists once an incremental refresh has run
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='bmi_changes'")
+        if cursor.fetchone() is None:
+            return {'changed_at': None, 'changes': []}
+
+        cursor.execute("""
+            SELECT id2, datei, change, changed_at FROM bmi_changes
+            WHERE statistics = ? AND termin = ? AND changed_at = (
+                SELECT MAX(changed_at) FROM bmi_changes WHERE statistics = ? AND termin = ?
+            )
+        """, (statistics, termin, statistics, termin))
+        rows = cursor.fetchall()
 
-    return True
+    return {
+        'changed_at': rows[0]['changed_at'] if rows else None,
+        'changes': [{'id2': row['id2'], 'datei': row['datei'], 'change': row['change']} for row in rows]
+    }
 
 
-def get_termin_statistics(termin, statistics='wpi'):
-    """Get statistics for a termin independent of any filters"""
-    conn = sqlite3.connect('bmi_data.db')
-    cursor = conn.cursor()
+def get_termin_statistics(termin, statistics='wpi', recompute=False):
+    """
+    Get statistics for a termin independent of any filters.
 
-    # Ensure termin doesn't already include the prefix
-    clean_termin = termin
-    if statistics == 'emiso' and termin.startswith('_EMISO'):
-        clean_termin = termin[6:]  # Remove _EMISO prefix if present
+    The counts come from termin_stats, which the writers and update_entry
+    keep current. With recompute they are first checked against a live scan
+    of the table and repaired if they differ.
+    """
+    with db_utils.sqlite_connection(DB_PATH) as conn:
+        if not recompute:
+            return read_termin_statistics(conn, termin, statistics)
 
-    table_prefix = get_table_prefix(statistics)
-    table_name = f"{table_prefix}{clean_termin}"
+        # No edit can slip in between the scan and the repair
+        conn.execute('BEGIN IMMEDIATE')
+        consistent = db_utils.check_termin_stats(conn, get_clean_termin(termin, statistics), statistics)
+        result = read_termin_statistics(conn, termin, statistics)
 
-    # Get total count
-    count_query = f"SELECT COUNT(*) FROM {table_name}"
-    cursor.execute(count_query)
-    total_count = cursor.fetchone()[0]
+    result['consistent'] = consistent
+    return result
 
-    # Get missing files count
-    missing_query = f"SELECT COUNT(*) FROM {table_name} WHERE (import_found IS NULL OR import_found = 0)"
-    cursor.execute(missing_query)
-    missing_count = cursor.fetchone()[0]
 
-    conn.close()
+def read_termin_statistics(conn, termin, statistics='wpi'):
+    """Read the statistics of a termin on the given connection, see get_termin_statistics"""
+    stats = db_utils.get_termin_stats(conn, get_clean_termin(termin, statistics), statistics)
+    if stats is None:
+        query, params = db_utils.termin_stats_query(get_bmi_source(conn, termin, statistics))
+        stats = [tuple(row) for row in conn.execute(query, params)]
 
-    return {
+    total_count, missing_count, rejected_count, ok_count = (
+        sum(row[2 + i] for row in stats) for i in range(len(STATS_COLUMNS)))
+
+    result = {
         'total': total_count,
         'missing_count': missing_count,
-        'missing_percentage': round((missing_count / total_count * 100), 2) if total_count > 0 else 0
+        'missing_percentage': round((missing_count / total_count * 100), 2) if total_count > 0 else 0,
+        'rejected_count': rejected_count,
+        'ok_count': ok_count,
+        'by_type': [dict(zip(('typ', 'institutstyp') + STATS_COLUMNS, row)) for row in stats]
     }
+    return result
+
+
+def get_termin_view(termin, statistics='wpi', page=1, page_size=20, sort_by='datei', sort_order='asc',
+                    filters=None, after=None, before=None, columns=None, columnar=False):
+    """
+    Get a page of a termin together with the termin's statistics.
+
+    Both are read in one transaction on one connection, so the page, its
+    total and the statistics come from the same snapshot even while a
+    refresh writes.
+
+    Returns:
+        dict: The get_data_for_termin result with the get_termin_statistics
+            result under 'statistics'
+    """
+    with db_utils.sqlite_connection(DB_PATH) as conn:
+        conn.execute('BEGIN')
+        view = read_data_page(conn, termin, statistics, page, page_size, sort_by, sort_order, filters, after, before,
+                              columns, columnar)
+        view['statistics'] = read_termin_statistics(conn, termin, statistics)
+    return view
+
+
+def export_termin(termin, statistics='wpi', format='csv', sort_by='datei', sort_order='asc', filters=None):
+    """
+    Stream all rows of a termin matching the filters as a file.
+
+    The rows are read through one cursor in a single read transaction and
+    serialized export.EXPORT_BATCH_SIZE rows at a time, so memory stays
+    constant however large the termin is. The connection is held until the
+    generator is exhausted or closed.
+
+    Args:
+        termin (str): Termin (YYYYMM)
+        statistics (str): Statistics type, 'wpi' or 'emiso'
+        format (str): 'csv', 'ndjson' or 'parquet'
+        sort_by (str): Column to sort by
+        sort_order (str): 'asc' or 'desc'
+        filters (dict): Filters as for get_data_for_termin
+
+    Yields:
+        bytes: Chunks of the file
+    """
+    with db_utils.sqlite_connection(DB_PATH) as conn:
+        conn.execute('BEGIN')
+        source = get_bmi_source(conn, termin, statistics)
+        search_columns = get_search_columns(conn, source, filters)
+        # LIMIT -1 lifts the page limit in SQLite
+        query, query_params, _, _ = build_data_query(
+            source, 1, -1, sort_by, sort_order, filters, search_columns=search_columns)
+        cursor = conn.cursor()
+        # Plain tuples serialize faster than sqlite3.Row
+        cursor.row_factory = None
+        cursor.execute(query, query_params)
+        columns = [column[0] for column in cursor.description]
+        yield from export.serialize(format, columns, export.iter_batches(cursor))
+
+
+def get_melder_history(melder_id, statistics='wpi', termins=12):
+    """
+    Get the counts of a melder's rows in each of the last termins.
+
+    In entries storage mode this is a single range scan of the
+    (statistics, melder_id, termin) index of bmi_entries; with one table per
+    termin every table is scanned for the melder.
+
+    Args:
+        melder_id (str): Melder to look up
+        statistics (str): Statistics type, 'wpi' or 'emiso'
+        termins (int): Number of most recent termins
+
+    Returns:
+        list: total, missing, rejected and ok counts per termin, most recent first
+    """
+    with db_utils.sqlite_connection(DB_PATH) as conn:
+        recent = [row[0] for row in conn.execute(
+            "SELECT termin FROM termin_catalog WHERE statistics = ? ORDER BY termin DESC LIMIT ?",
+            (statistics, termins))]
+        if not recent:
+            return []
+
+        if db_utils.get_storage_mode(conn) == 'entries':
+            rows = conn.execute(f"""
+                SELECT termin, {db_utils.TERMIN_STATS_COUNTS} FROM {db_utils.ENTRIES_TABLE}
+                WHERE statistics = ? AND melder_id = ? AND termin >= ? GROUP BY termin
+            """, (statistics, melder_id, recent[-1])).fetchall()
+        else:
+            query = " UNION ALL ".join(
+                f"SELECT ? AS termin, {db_utils.TERMIN_STATS_COUNTS} FROM {db_utils.bmi_table_name(termin, statistics)} "
+                f"WHERE melder_id = ?" for termin in recent)
+            rows = conn.execute(query, [value for termin in recent for value in (termin, melder_id)]).fetchall()
+
+    counts = {row['termin']: row for row in rows}
+    return [{'termin': termin, **{column: counts[termin][column] if termin in counts else 0
+                                  for column in STATS_COLUMNS}} for termin in recent]
+
+
+def get_termin_version(termin, statistics='wpi'):
+    """Get the ETag and Last-Modified of a termin's data from the catalog, (None, None) if it has no entry"""
+    clean_termin = get_clean_termin(termin, statistics)
+    with db_utils.sqlite_connection(DB_PATH) as conn:
+        version = db_utils.get_data_version(conn, clean_termin, statistics)
+    if version is None:
+        return None, None
+    data_version, last_modified = version
+    return f"{statistics}-{clean_termin}-{data_version}", last_modified
+
+
+def get_catalog_version(statistics='wpi'):
+    """Get the ETag and Last-Modified of the termin list, which changes with every termin's data version"""
+    with db_utils.sqlite_connection(DB_PATH) as conn:
+        rows = conn.execute("SELECT termin, data_version, last_modified FROM termin_catalog WHERE statistics = ? "
+                            "ORDER BY termin", (statistics,)).fetchall()
+    versions = ','.join(f"{row['termin']}:{row['data_version']}" for row in rows)
+    digest = hashlib.blake2b(versions.encode(), digest_size=8).hexdigest()
+    return f"{statistics}-{digest}", max((row['last_modified'] or 0 for row in rows), default=None) or None
+
+
+def conditional_response(etag, last_modified, view):
+    """
+    Answer 304 Not Modified if the client already has this version, else the response of view().
+
+    The version is read before view() runs, so a write in between can only
+    make the client fetch once more, never keep stale data. no-cache makes
+    browsers revalidate on every request instead of using their copy unchecked.
+    """
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.make_response(view())
+    if etag is not None and response.status_code in (200, 304):
+        # Weak, since compress_response may send the same data in different encodings
+        response.set_etag(etag, weak=True)
+        if last_modified:
+            response.last_modified = datetime.datetime.fromtimestamp(last_modified, datetime.timezone.utc)
+        response.cache_control.no_cache = True
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """Compress JSON responses with brotli or gzip, whichever the client accepts"""
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or response.mimetype != 'application/json' or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.content_length or 0) < COMPRESS_MIN_SIZE:
+        return response
+
+    if brotli is not None and request.accept_encodings['br']:
+        response.set_data(brotli.compress(response.get_data(), quality=4))
+        response.headers['Content-Encoding'] = 'br'
+    elif request.accept_encodings['gzip']:
+        response.set_data(gzip.compress(response.get_data(), compresslevel=6, mtime=0))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
 
 
 @app.route('/')
 def index():
     """Render the dashboard page"""
-    settings = get_settings()
+    settings = settings_store.get_settings()
     current_statistics = settings.get('statistics', 'wpi')
-    termins = get_termins(current_statistics)
+    termins = get_termin_catalog(current_statistics)
     return render_template('index.html', termins=termins, settings=settings)
 
 
@@ -278,47 +670,124 @@ def index():
 def api_termins():
     """API endpoint to get all termins"""
     statistics = request.args.get('statistics', 'wpi')
-    termins = get_termins(statistics)
-    return jsonify(termins)
-
+    etag, last_modified = get_catalog_version(statistics)
+    if request.args.get('details') == 'true':
+        return conditional_response(etag, last_modified, lambda: jsonify(get_termin_catalog(statistics)))
+    return conditional_response(etag, last_modified, lambda: jsonify(get_termins(statistics)))
 
-@app.route('/api/data/<termin>', methods=['GET'])
-def api_data(termin):
-    """API endpoint to get data for a specific termin"""
-    statistics = request.args.get('statistics', 'wpi')
-    page = int(request.args.get('page', 1))
-    page_size = int(request.args.get('page_size', 20))
-    sort_by = request.args.get('sort_by', 'datei')
-    sort_order = request.args.get('sort_order', 'asc')
 
-    # Handle filters
+def request_filters(args):
+    """Get the filters of a data request from its query string or a JSON object with the same keys"""
     filters = {}
-    for key in ['datei', 'timestamp', 'melder_id', 'typ']:
-        if request.args.get(key):
-            filters[key] = request.args.get(key)
+    for key in ['datei', 'erstellt', 'melder_id', 'typ']:
+        if args.get(key):
+            filters[key] = str(args.get(key))
 
     # Special filter for missing files
-    if request.args.get('missing_files') == 'true':
+    if str(args.get('missing_files')).lower() == 'true':
         filters['import_found'] = 'false'
 
     # Special filter for rejected files
-    if request.args.get('rejected_files') == 'true':
+    if str(args.get('rejected_files')).lower() == 'true':
         filters['rejected_import_found'] = 'true'
 
     # Special filter for OK status
-    if request.args.get('ok') == 'true':
+    if str(args.get('ok')).lower() == 'true':
         filters['ok'] = 'true'
 
-    data = get_data_for_termin(termin, statistics, page, page_size, sort_by, sort_order, filters)
+    return filters
+
+
+def data_request_args():
+    """Get the page, page size, sort and filters of a data request from its query string"""
+    page = int(request.args.get('page', 1))
+    page_size = int(request.args.get('page_size', 20))
+    sort_by = request.args.get('sort_by', 'datei')
+    sort_order = request.args.get('sort_order', 'asc')
+    return page, page_size, sort_by, sort_order, request_filters(request.args)
+
+
+def cached_data_response(reader, termin, statistics, etag):
+    """
+    Answer a data request with reader's result, shared with identical concurrent or recent requests.
+
+    The cache key holds the termin's data version (its ETag), so a refresh or
+    edit is never answered from a result computed before it. Without a
+    catalog entry there is no version and nothing is cached.
+    """
+    after, before = request.args.get('after'), request.args.get('before')
+    try:
+        args = data_request_args()
+        page, page_size, sort_by, sort_order, filters = args
+        columns = tuple(column for column in request.args.get('columns', '').split(',') if column) or None
+        shape = request.args.get('shape', 'rows')
+        if shape not in ('rows', 'columnar'):
+            raise ValueError(f"Invalid shape {shape!r}")
+
+        def compute():
+            return reader(termin, statistics, *args, after=after, before=before, columns=columns,
+                          columnar=shape == 'columnar')
+
+        if etag is None:
+            data = compute()
+        else:
+            key = (reader.__name__, etag, page, page_size, sort_by, sort_order, tuple(sorted(filters.items())),
+                   after, before, columns, shape)
+            data = query_cache.get_or_compute(key, compute)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     return jsonify(data)
 
 
+@app.route('/api/data/<termin>', methods=['GET'])
+def api_data(termin):
+    """API endpoint to get data for a specific termin"""
+    statistics = request.args.get('statistics', 'wpi')
+    etag, last_modified = get_termin_version(termin, statistics)
+    return conditional_response(etag, last_modified,
+                                lambda: cached_data_response(get_data_for_termin, termin, statistics, etag))
+
+
+@app.route('/api/view/<termin>', methods=['GET'])
+def api_view(termin):
+    """API endpoint to get a page of a termin and its statistics in one request"""
+    statistics = request.args.get('statistics', 'wpi')
+    etag, last_modified = get_termin_version(termin, statistics)
+    return conditional_response(etag, last_modified,
+                                lambda: cached_data_response(get_termin_view, termin, statistics, etag))
+
+
+@app.route('/api/export/<termin>', methods=['GET'])
+def api_export(termin):
+    """API endpoint to download all rows of a termin matching the /api/data filters"""
+    statistics = request.args.get('statistics', 'wpi')
+    format = request.args.get('format', 'csv')
+    _, _, sort_by, sort_order, filters = data_request_args()
+
+    chunks = export_termin(termin, statistics, format, sort_by, sort_order, filters)
+    try:
+        # Run the query before answering, so invalid arguments still get a 400
+        first = next(chunks, b"")
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    chunks = itertools.chain([first], chunks)
+
+    headers = {
+        'Content-Disposition': f'attachment; filename={get_clean_termin(termin, statistics)}_{statistics}.{format}',
+        'Vary': 'Accept-Encoding'
+    }
+    if request.accept_encodings['gzip']:
+        chunks = export.gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return app.response_class(chunks, content_type=export.EXPORT_FORMATS[format], headers=headers)
+
+
 @app.route('/api/entry/<termin>/<id2>', methods=['GET'])
 def api_entry(termin, id2):
     """API endpoint to get details for a specific entry"""
     statistics = request.args.get('statistics', 'wpi')
-    entry = get_entry_details(termin, id2, statistics)
-    return jsonify(entry)
+    etag, last_modified = get_termin_version(termin, statistics)
+    return conditional_response(etag, last_modified, lambda: jsonify(get_entry_details(termin, id2, statistics)))
 
 
 @app.route('/api/entry/<termin>/<id2>', methods=['PUT'])
@@ -333,34 +802,98 @@ def api_update_entry(termin, id2):
     return jsonify({'success': success})
 
 
+@app.route('/api/entries/<termin>', methods=['PATCH'])
+def api_update_entries(termin):
+    """API endpoint to update many entries at once, by a list of id2s or by filters"""
+    statistics = request.args.get('statistics', 'wpi')
+    data = request.get_json(silent=True)
+    try:
+        if not isinstance(data, dict):
+            raise ValueError("The request body must be a JSON object")
+        if 'entries' in data:
+            updated = update_entries(termin, statistics, entries=data['entries'])
+        else:
+            filters = data.get('filters', {})
+            if not isinstance(filters, dict):
+                raise ValueError("filters must be an object")
+            updated = update_entries(termin, statistics, filters=request_filters(filters),
+                                     comment=data.get('comment'), ok=data.get('ok'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'updated': updated})
+
+
 @app.route('/api/update', methods=['POST'])
 def api_update_data():
-    """API endpoint to trigger data update"""
+    """API endpoint to start a data update job, returns the job id right away"""
     data = request.get_json()
     termin = data.get('termin')
     statistics = data.get('statistics', 'wpi')
+    incremental = bool(data.get('incremental', False))
 
     if termin:
         # Validate termin format (YYYYMM)
         if not termin.isdigit() or len(termin) != 6:
             return jsonify({'success': False, 'error': 'Invalid termin format. Must be YYYYMM (e.g., 202405)'})
 
+        # The unpaged list stops at BMI_LIST_SIZE rows, so a termin that already has that many is fetched page by page
+        paged = data.get('paged')
+        if paged is None:
+            row_counts = {entry['termin']: entry['row_count'] for entry in get_termin_catalog(statistics)}
+            paged = (row_counts.get(termin) or 0) >= process_bmi.BMI_LIST_SIZE
+
         try:
-            # Get settings to pass to the process function
-            settings = get_settings()
-            process_data(termin, statistics)
-            return jsonify({'success': True})
+            job_id, attached = jobs.submit_refresh(termin, statistics, {'incremental': incremental,
+                                                                        'paged': bool(paged)})
+            return jsonify({'success': True, 'job_id': job_id, 'attached': attached})
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)})
     return jsonify({'success': False, 'error': 'No termin provided'})
 
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_job(job_id):
+    """API endpoint to get the stage, row count and elapsed time of an update job"""
+    job = jobs.get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
+    return jsonify(job)
+
+
 @app.route('/api/statistics/<termin>', methods=['GET'])
 def api_statistics(termin):
     """API endpoint to get statistics for a specific termin"""
     statistics = request.args.get('statistics', 'wpi')
-    stats = get_termin_statistics(termin, statistics)
-    return jsonify(stats)
+    recompute = request.args.get('recompute') in ('1', 'true')
+    if recompute:
+        # A recompute has to scan the table whatever the client has
+        return jsonify(get_termin_statistics(termin, statistics, recompute))
+    etag, last_modified = get_termin_version(termin, statistics)
+    return conditional_response(etag, last_modified, lambda: jsonify(get_termin_statistics(termin, statistics)))
+
+
+@app.route('/api/changes/<termin>', methods=['GET'])
+def api_changes(termin):
+    """API endpoint to get the changes of the last incremental refresh"""
+    statistics = request.args.get('statistics', 'wpi')
+    changes = get_termin_changes(termin, statistics)
+    return jsonify(changes)
+
+
+@app.route('/api/indexes/<termin>', methods=['GET'])
+def api_indexes(termin):
+    """API endpoint to check which indexes the dashboard queries of a termin use"""
+    statistics = request.args.get('statistics', 'wpi')
+    report = get_index_report(termin, statistics)
+    return jsonify(report)
+
+
+@app.route('/api/melder/<melder_id>', methods=['GET'])
+def api_melder(melder_id):
+    """API endpoint to get the counts of a melder over the last termins"""
+    statistics = request.args.get('statistics', 'wpi')
+    termins = request.args.get('termins', 12, type=int)
+    return jsonify(get_melder_history(melder_id, statistics, termins))
 
 
 @app.route('/api/switch_statistics', methods=['POST'])
@@ -370,7 +903,7 @@ def api_switch_statistics():
     statistics = data.get('statistics')
 
     if statistics in ['wpi', 'emiso']:
-        success = update_settings({'statistics': statistics})
+        success = settings_store.update_settings({'statistics': statistics})
         return jsonify({'success': success})
     return jsonify({'success': False, 'error': 'Invalid statistics type'})
 
@@ -378,14 +911,14 @@ def api_switch_statistics():
 @app.route('/settings')
 def settings_page():
     """Render the settings page"""
-    settings = get_settings()
+    settings = settings_store.get_settings()
     return render_template('settings.html', settings=settings)
 
 
 @app.route('/api/settings', methods=['GET'])
 def api_get_settings():
     """API endpoint to get all settings"""
-    settings = get_settings()
+    settings = settings_store.get_settings()
     return jsonify(settings)
 
 
@@ -393,11 +926,38 @@ def api_get_settings():
 def api_update_settings():
     """API endpoint to update settings"""
     new_settings = request.get_json()
-    success = update_settings(new_settings)
+    success = settings_store.update_settings(new_settings)
     return jsonify({'success': success})
 
 
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Health check for the reverse proxy, 503 if the database can't be read or the server is shutting down"""
+    try:
+        with db_utils.sqlite_connection(DB_PATH) as conn:
+            conn.execute("SELECT 1").fetchone()
+    except Exception as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 503
+
+    status = jobs.get_status()
+    if not status['accepting']:
+        return jsonify({'status': 'shutting_down', **status}), 503
+    return jsonify({'status': 'ok', **status})
+
+
+def create_app():
+    """
+    Prepare the database and return the application.
+
+    Creates the settings and catalog tables and migrates the BMI tables, so
+    every way of serving the app starts from the same state, not only
+    running this module. Safe to call more than once.
+    """
+    settings_store.initialize_settings()
+    db_utils.migrate_bmi_tables(DB_PATH)
+    return app
+
+
 if __name__ == '__main__':
-    # Initialize settings when app starts
-    initialize_settings()
-    app.run(debug=True, host="0.0.0.0")
\ No newline at end of file
+    # Development server with reloader and debugger, serve.py is the production entry point
+    create_app().run(debug=True, host="0.0.0.0")
\ No newline at end of file
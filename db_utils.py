@@ -1,34 +1,630 @@
 import pyodbc
 from pathlib import Path
-
-root_dir = Path
 import sqlite3
+import time
+import hashlib
+import datetime
+import re
+import queue
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+
+SQL_FETCH_ARRAYSIZE = 5000
+SQL_LOOKUP_CHUNK_SIZE = 1000  # Keys per IN list; SQL Server accepts at most 2100 parameters per statement
+SQL_LOOKUP_KEYS_TABLE = '#lookup_keys'  # Session temp table the keys of a SQL Server lookup are loaded into
+
+SQLITE_POOL_SIZE = 8
+# Applied once to every SQLite connection; WAL lets readers continue while a refresh writes
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-20000',  # 20 MB page cache
+    'PRAGMA mmap_size=268435456',  # 256 MB
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA busy_timeout=5000',
+)
+
+SQL_DIR = Path(__file__).resolve().parent / 'sql'
+STATISTICS_TYPES = ('wpi', 'emiso')
+BMI_TABLE_PATTERN = re.compile(r'BMI(_EMISO)?\d{6}')
+CUT_DATE_PATTERN = re.compile(r'\d{8}')
+
+# Templates every statistics type needs, with the placeholder each one must contain.
+# Files in sql/<statistics> are registered without their WPI_/EMISO_ prefix.
+REQUIRED_TEMPLATES = {
+    'CREATE_BMI_DATA': '{termin}',
+    'INSERT_BMI_DATA': '{termin}',
+    'IMPORTE': '{IMPORT_CUT_DATE}',
+    'IMPORTE_ABGEWIESEN': '{IMPORT_CUT_DATE}',
+}
+# Templates in sql/ shared by all statistics types
+SHARED_TEMPLATES = ('CREATE_BMI_CHANGES', 'CREATE_TERMIN_STATS', 'CREATE_TERMIN_CATALOG', 'CREATE_BMI_ENTRIES',
+                    'INSERT_BMI_ENTRIES')
+
+# Indexes every BMI table gets: name suffix, columns and the condition of a partial index.
+# The quick-filter indexes are ordered like the default datei sort, so the missing, rejected
+# and ok views read a page straight from the index. The conditions must match the filter
+# clauses of the dashboard queries exactly, otherwise SQLite does not use the index.
+BMI_INDEXES = (
+    ('datei', 'datei, id2', None),
+    ('missing', 'datei, id2', 'import_found IS NULL OR import_found = 0'),
+    ('rejected', 'datei, id2', 'rejected_import_found = 1'),
+    ('ok', 'datei, id2', 'ok = 1'),
+)
+# Single table holding all termins once migrate_to_entries ran. Its BMI_INDEXES lead with
+# (statistics, termin), so each one serves a single termin like on a per-termin table.
+ENTRIES_TABLE = 'bmi_entries'
+# Indexes only bmi_entries gets, for views across termins
+ENTRIES_INDEXES = (
+    ('melder', 'statistics, melder_id, termin', None),
+)
+# Text columns behind the dashboard's substring filters, kept in a trigram FTS5 index
+BMI_FTS_COLUMNS = ('datei', 'erstellt', 'melder_id', 'typ')
+# A substring matching more than this share of the rows is filtered faster by a plain scan
+BMI_FTS_MAX_SELECTIVITY = 0.1
+
+
+def load_sql_templates(sql_dir=SQL_DIR):
+    """
+    Read and validate all SQL templates once.
+
+    Raises:
+        FileNotFoundError: If a required template is missing
+        ValueError: If a template lacks its placeholder
+    """
+    templates = {}
+    for path in sql_dir.glob('*.sql'):
+        templates[(None, path.stem)] = path.read_text()
+    for name in SHARED_TEMPLATES:
+        if (None, name) not in templates:
+            raise FileNotFoundError(f"Missing SQL template {sql_dir / name}.sql")
+
+    for statistics in STATISTICS_TYPES:
+        prefix = f"{statistics.upper()}_"
+        for path in (sql_dir / statistics).glob('*.sql'):
+            name = path.stem[len(prefix):] if path.stem.startswith(prefix) else path.stem
+            templates[(statistics, name)] = path.read_text()
+
+        for name, placeholder in REQUIRED_TEMPLATES.items():
+            template = templates.get((statistics, name))
+            if template is None:
+                raise FileNotFoundError(f"Missing SQL template {name} in {sql_dir / statistics}")
+            if placeholder not in template:
+                raise ValueError(f"SQL template {name} for {statistics} does not contain {placeholder}")
+    return templates
+
+
+# Loaded at import time, so a missing or broken template stops the application on startup
+SQL_TEMPLATES = load_sql_templates()
+
+
+def sql_template(name, statistics=None):
+    try:
+        return SQL_TEMPLATES[(statistics, name)]
+    except KeyError:
+        raise ValueError(f"No SQL template {name} for statistics type {statistics}")
+
+
+def bmi_table_name(termin, statistics):
+    """Get the per-termin table name for a statistics type, raises ValueError for anything unexpected"""
+    table_name = f"BMI_EMISO{termin}" if statistics == 'emiso' else f"BMI{termin}"
+    if statistics not in STATISTICS_TYPES or not BMI_TABLE_PATTERN.fullmatch(table_name):
+        raise ValueError(f"Invalid termin {termin!r} for statistics type {statistics!r}")
+    return table_name
+
+
+def bmi_table_termin(table_name):
+    """Get the (termin, statistics) of a BMI table name"""
+    if table_name.startswith('BMI_EMISO'):
+        return table_name[len('BMI_EMISO'):], 'emiso'
+    return table_name[len('BMI'):], 'wpi'
+
+
+@lru_cache(maxsize=None)
+def bmi_statement(name, termin, statistics):
+    """Render a per-termin template for a whitelisted table name"""
+    bmi_table_name(termin, statistics)
+    return sql_template(name, statistics).replace('{termin}', termin)
+
+
+@lru_cache(maxsize=None)
+def importe_source_statement(name, statistics, cut_date):
+    """Render an importe template for a validated cut date (YYYYMMDD)"""
+    if not CUT_DATE_PATTERN.fullmatch(cut_date):
+        raise ValueError(f"Invalid import cut date {cut_date!r}, must be YYYYMMDD")
+    return sql_template(name, statistics).replace('{IMPORT_CUT_DATE}', cut_date)
 
 
 def create_bmi_table_statement(termin, statistics):
-    with open(f'sql/{statistics}/CREATE_BMI_DATA.sql') as input:
-        return input.read().replace('{termin}', termin)
+    return bmi_statement('CREATE_BMI_DATA', termin, statistics)
 
 
 def insert_bmi_data_statement(termin, statistics):
-    with open(f'sql/{statistics}/INSERT_BMI_DATA.sql') as input:
-        return input.read().replace('{termin}', termin)
+    return bmi_statement('INSERT_BMI_DATA', termin, statistics)
+
+
+def bmi_changes_statement():
+    return sql_template('CREATE_BMI_CHANGES')
+
+
+def termin_stats_statement():
+    return sql_template('CREATE_TERMIN_STATS')
+
+
+def termin_catalog_statement():
+    return sql_template('CREATE_TERMIN_CATALOG')
+
+
+def create_bmi_entries_statement():
+    return sql_template('CREATE_BMI_ENTRIES')
+
+
+def insert_bmi_entries_statement():
+    return sql_template('INSERT_BMI_ENTRIES')
+
+
+def importe_statement(statistics, cut_date):
+    return importe_source_statement('IMPORTE', statistics, cut_date)
+
+
+def importe_abgewiesen_statement(statistics, cut_date):
+    return importe_source_statement('IMPORTE_ABGEWIESEN', statistics, cut_date)
 
 
 def wpi_importe_statement(cut_date):
-    with open('sql/wpi/WPI_IMPORTE.sql') as input:
-        return input.read().replace('{IMPORT_CUT_DATE}', cut_date)
+    return importe_statement('wpi', cut_date)
+
+
 def emiso_importe_statement(cut_date):
-    with open('sql/emiso/EMISO_IMPORTE.sql') as input:
-        return input.read().replace('{IMPORT_CUT_DATE}', cut_date)
+    return importe_statement('emiso', cut_date)
+
 
 def wpi_importe_abgewiesen_statement(cut_date):
-    with open('sql/wpi/WPI_IMPORTE_ABGEWIESEN.sql') as input:
-        return input.read().replace('{IMPORT_CUT_DATE}', cut_date)
+    return importe_abgewiesen_statement('wpi', cut_date)
+
 
 def emiso_importe_abgewiesen_statement(cut_date):
-        with open('sql/emiso/EMISO_IMPORTE_ABGEWIESEN.sql') as input:
-            return input.read().replace('{IMPORT_CUT_DATE}', cut_date)
+    return importe_abgewiesen_statement('emiso', cut_date)
+
+
+BmiSource = namedtuple('BmiSource', ['table', 'where', 'params'])
+
+
+def get_storage_mode(conn):
+    """Get how BMI rows are stored: 'entries' once migrate_to_entries ran, else 'tables' (one per termin)"""
+    row = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name = ?", (ENTRIES_TABLE,)).fetchone()
+    return 'entries' if row else 'tables'
+
+
+def bmi_source(conn, termin, statistics):
+    """
+    Get where the rows of a termin are stored.
+
+    Returns:
+        BmiSource: The table, the WHERE clauses selecting the termin's rows in
+            it and their parameters; the clauses are empty for a per-termin table
+    """
+    table_name = bmi_table_name(termin, statistics)
+    if get_storage_mode(conn) == 'entries':
+        return BmiSource(ENTRIES_TABLE, ['statistics = ?', 'termin = ?'], [statistics, termin])
+    return BmiSource(table_name, [], [])
+
+
+def where_clause(clauses):
+    """Join WHERE clauses, an empty string if there are none"""
+    return " WHERE " + " AND ".join(clauses) if clauses else ""
+
+
+def bmi_index_statements(table_name):
+    """Get the names and CREATE INDEX statements of the indexes of a BMI table"""
+    indexes = BMI_INDEXES
+    if table_name == ENTRIES_TABLE:
+        indexes = [(suffix, f"statistics, termin, {columns}", condition) for suffix, columns, condition in BMI_INDEXES]
+        indexes += ENTRIES_INDEXES
+
+    statements = []
+    for suffix, columns, condition in indexes:
+        statement = f"CREATE INDEX IF NOT EXISTS {table_name}_{suffix} ON {table_name} ({columns})"
+        if condition:
+            statement += f" WHERE {condition}"
+        statements.append((f"{table_name}_{suffix}", statement))
+    return statements
+
+
+def ensure_bmi_indexes(conn, table_name):
+    """Create the missing indexes of a BMI table, returns the names of the indexes created"""
+    existing = {row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name = ?", (table_name,))}
+    created = []
+    for index_name, statement in bmi_index_statements(table_name):
+        if index_name not in existing:
+            conn.execute(statement)
+            created.append(index_name)
+    return created
+
+
+def bmi_fts_statements(table_name):
+    """
+    Get the statements creating the search index of a BMI table.
+
+    The index is an external-content FTS5 table over BMI_FTS_COLUMNS with the
+    trigram tokenizer, so substring filters are answered from the index.
+    Triggers keep it in step with every insert, upsert and delete.
+    """
+    fts_table = f"{table_name}_fts"
+    columns = ', '.join(BMI_FTS_COLUMNS)
+    new_values = ', '.join(f"new.{column}" for column in BMI_FTS_COLUMNS)
+    old_values = ', '.join(f"old.{column}" for column in BMI_FTS_COLUMNS)
+    insert_new = f"INSERT INTO {fts_table} (rowid, {columns}) VALUES (new.rowid, {new_values});"
+    delete_old = (f"INSERT INTO {fts_table} ({fts_table}, rowid, {columns}) "
+                  f"VALUES ('delete', old.rowid, {old_values});")
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5({columns}, "
+        f"content='{table_name}', content_rowid='rowid', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_insert AFTER INSERT ON {table_name} BEGIN {insert_new} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_delete AFTER DELETE ON {table_name} BEGIN {delete_old} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_update AFTER UPDATE OF {columns} ON {table_name} "
+        f"BEGIN {delete_old} {insert_new} END",
+    ]
+
+
+def ensure_bmi_fts(conn, table_name):
+    """Create the search index of a BMI table if it is missing, returns True if it was created"""
+    if conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name = ?",
+                    (f"{table_name}_fts",)).fetchone() is not None:
+        return False
+    rebuild_bmi_fts(conn, table_name)
+    return True
+
+
+def drop_bmi_fts_triggers(conn, table_name):
+    """Stop the search index from following writes to a BMI table until rebuild_bmi_fts runs"""
+    for trigger in ('insert', 'delete', 'update'):
+        conn.execute(f"DROP TRIGGER IF EXISTS {table_name}_fts_{trigger}")
+
+
+def rebuild_bmi_fts(conn, table_name):
+    """Index all rows of a BMI table in one pass and (re)create the triggers of its search index"""
+    for statement in bmi_fts_statements(table_name):
+        conn.execute(statement)
+    conn.execute(f"INSERT INTO {table_name}_fts ({table_name}_fts) VALUES ('rebuild')")
+
+
+def unindex_bmi_fts_rows(conn, source):
+    """Remove the rows of a BMI source from its search index and drop the triggers until index_bmi_fts_rows runs"""
+    drop_bmi_fts_triggers(conn, source.table)
+    columns = ', '.join(BMI_FTS_COLUMNS)
+    conn.execute(f"INSERT INTO {source.table}_fts ({source.table}_fts, rowid, {columns}) "
+                 f"SELECT 'delete', rowid, {columns} FROM {source.table}{where_clause(source.where)}", source.params)
+
+
+def index_bmi_fts_rows(conn, source):
+    """Add the rows of a BMI source to its search index and recreate the triggers"""
+    for statement in bmi_fts_statements(source.table):
+        conn.execute(statement)
+    columns = ', '.join(BMI_FTS_COLUMNS)
+    conn.execute(f"INSERT INTO {source.table}_fts (rowid, {columns}) "
+                 f"SELECT rowid, {columns} FROM {source.table}{where_clause(source.where)}", source.params)
+
+
+def bmi_fts_match(column, value):
+    """
+    Get the MATCH expression finding a substring in one column of a search index.
+
+    With the trigram tokenizer a phrase of the value's trigrams matches
+    exactly the rows containing it, like LIKE '%value%' does, but from the
+    index alone. Values shorter than three characters or containing LIKE
+    wildcards have no such phrase and return None.
+    """
+    if len(value) < 3 or '%' in value or '_' in value:
+        return None
+    return f'{column} : "{value.replace(chr(34), chr(34) * 2)}"'
+
+
+def bmi_like_filter(column, value):
+    """
+    Get the LIKE clause and parameter of a substring filter the search index does not answer.
+
+    LIKE only ignores the case of ASCII letters while the trigram index folds
+    all of them, so a non-ASCII value is compared with the folded column to
+    match the same rows either way, whatever its length.
+    """
+    if value.isascii():
+        return f"{column} LIKE ?", f"%{value}%"
+    return f"fold_case({column}) LIKE ?", f"%{fold_case(value)}%"
+
+
+def bmi_fts_is_selective(conn, table_name, column, value):
+    """Check whether the search index narrows a substring filter enough to beat a scan"""
+    match = bmi_fts_match(column, value)
+    if match is None:
+        return False
+
+    # Rowids stay dense under the upserts, so the largest one estimates the row count cheaply
+    row_count = conn.execute(f"SELECT MAX(rowid) FROM {table_name}").fetchone()[0] or 0
+    limit = int(row_count * BMI_FTS_MAX_SELECTIVITY)
+    # Stop counting as soon as the filter is known to be too broad
+    matches = conn.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM {table_name}_fts WHERE {table_name}_fts MATCH ? "
+                           f"LIMIT ?)", (match, limit + 1)).fetchone()[0]
+    return matches <= limit
+
+
+# Total, missing, rejected and ok counts with the dashboard filter conditions
+TERMIN_STATS_COUNTS = """COUNT(*) AS total,
+               COUNT(*) FILTER (WHERE import_found IS NULL OR import_found = 0) AS missing,
+               COUNT(*) FILTER (WHERE rejected_import_found = 1) AS rejected,
+               COUNT(*) FILTER (WHERE ok = 1) AS ok"""
+
+
+def termin_stats_query(source):
+    """Get the query counting a termin's rows by typ and institutstyp with the dashboard filter conditions, and its params"""
+    return f"""
+        SELECT COALESCE(typ, '') AS typ, COALESCE(institutstyp, '') AS institutstyp, {TERMIN_STATS_COUNTS}
+        FROM {source.table}{where_clause(source.where)} GROUP BY 1, 2
+    """, list(source.params)
+
+
+def refresh_termin_stats(conn, termin, statistics):
+    """Recompute the stored counts of a termin from its BMI rows, inside the caller's transaction"""
+    query, params = termin_stats_query(bmi_source(conn, termin, statistics))
+    conn.execute("DELETE FROM termin_stats WHERE statistics = ? AND termin = ?", (statistics, termin))
+    conn.execute(f"INSERT INTO termin_stats (statistics, termin, typ, institutstyp, total, missing, rejected, ok) "
+                 f"SELECT ?, ?, * FROM ({query})", (statistics, termin, *params))
+
+
+def adjust_termin_stats(conn, termin, statistics, typ, institutstyp, ok=0):
+    """Apply the change of one edited row to the stored counts of its typ/institutstyp group"""
+    if ok:
+        conn.execute("UPDATE termin_stats SET ok = ok + ? WHERE statistics = ? AND termin = ? AND typ = ? "
+                     "AND institutstyp = ?", (ok, statistics, termin, typ or '', institutstyp or ''))
+
+
+def get_termin_stats(conn, termin, statistics):
+    """
+    Get the stored counts of a termin by typ and institutstyp.
+
+    Returns:
+        list: Rows with typ, institutstyp, total, missing, rejected and ok,
+            None if the counts were never computed
+    """
+    rows = conn.execute("SELECT typ, institutstyp, total, missing, rejected, ok FROM termin_stats "
+                        "WHERE statistics = ? AND termin = ? ORDER BY typ, institutstyp",
+                        (statistics, termin)).fetchall()
+    if not rows:
+        # An empty termin has no groups either, that answer is as cheap to count live
+        return None
+    return [tuple(row) for row in rows]
+
+
+def check_termin_stats(conn, termin, statistics):
+    """Compare the stored counts of a termin with a live scan and repair them, returns True if they matched"""
+    query, params = termin_stats_query(bmi_source(conn, termin, statistics))
+    live = sorted(tuple(row) for row in conn.execute(query, params))
+    if get_termin_stats(conn, termin, statistics) == (live or None):
+        return True
+    print(f"Stored statistics of {termin} in {statistics} were out of date, recomputing")
+    refresh_termin_stats(conn, termin, statistics)
+    bump_data_version(conn, termin, statistics)
+    return False
+
+
+# Columns added to termin_catalog after its first version, with their definitions
+TERMIN_CATALOG_ADDED_COLUMNS = (
+    ('data_version', 'INTEGER NOT NULL DEFAULT 0'),
+    ('last_modified', 'REAL'),
+)
+
+
+def ensure_termin_catalog(conn):
+    """Create the termin catalog, or add the columns a catalog from an older version lacks"""
+    conn.executescript(termin_catalog_statement())
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(termin_catalog)")}
+    for column, definition in TERMIN_CATALOG_ADDED_COLUMNS:
+        if column not in existing:
+            conn.execute(f"ALTER TABLE termin_catalog ADD COLUMN {column} {definition}")
+
+
+def bump_data_version(conn, termin, statistics):
+    """Mark the data of a termin as changed for conditional requests, inside the caller's transaction"""
+    conn.execute("UPDATE termin_catalog SET data_version = data_version + 1, last_modified = ? "
+                 "WHERE statistics = ? AND termin = ?", (time.time(), statistics, termin))
+
+
+def get_data_version(conn, termin, statistics):
+    """Get the (data_version, last_modified) of a termin from the catalog, None if it has no entry"""
+    row = conn.execute("SELECT data_version, last_modified FROM termin_catalog WHERE statistics = ? AND termin = ?",
+                       (statistics, termin)).fetchone()
+    return tuple(row) if row else None
+
+
+def record_termin_refresh(conn, termin, statistics, refresh_duration=None, source_watermark=None,
+                          last_refresh=None):
+    """
+    Write the catalog entry of a termin and bump its data version, inside the caller's transaction.
+
+    Args:
+        conn: sqlite3 connection to the BMI database
+        termin (str): Termin (YYYYMM)
+        statistics (str): Statistics type, 'wpi' or 'emiso'
+        refresh_duration (float): Seconds the refresh took
+        source_watermark (str): High-watermark of the importe source, defaults
+            to the newest empfangszeit in the termin
+        last_refresh (str): Time of the refresh, defaults to now
+    """
+    source = bmi_source(conn, termin, statistics)
+    row_count, newest_import = conn.execute(
+        f"SELECT COUNT(*), MAX(empfangszeit) FROM {source.table}{where_clause(source.where)}", source.params).fetchone()
+    conn.execute("""
+        INSERT INTO termin_catalog (statistics, termin, row_count, last_refresh, refresh_duration, source_watermark,
+                                    data_version, last_modified)
+        VALUES (?, ?, ?, ?, ?, ?, 1, ?)
+        ON CONFLICT (statistics, termin) DO UPDATE SET
+            row_count = excluded.row_count, last_refresh = excluded.last_refresh,
+            refresh_duration = excluded.refresh_duration, source_watermark = excluded.source_watermark,
+            data_version = data_version + 1, last_modified = excluded.last_modified
+    """, (statistics, termin, row_count, last_refresh or datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+          round(refresh_duration, 3) if refresh_duration is not None else None,
+          source_watermark or newest_import or None, time.time()))
+
+
+def migrate_bmi_tables(db_path):
+    """
+    Bring every BMI table created by an older version up to date.
+
+    Adds the missing indexes and search indexes, computes the stored
+    statistics of termins that have none yet and adds termins missing from
+    the catalog, with the time their rows were last fetched from BMI.
+
+    Returns:
+        int: Number of indexes created
+    """
+    conn = connect_sqlite(db_path)
+    try:
+        conn.executescript(termin_stats_statement())
+        ensure_termin_catalog(conn)
+        catalog = set(conn.execute("SELECT statistics, termin FROM termin_catalog"))
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
+                  if BMI_TABLE_PATTERN.fullmatch(row[0]) or row[0] == ENTRIES_TABLE]
+        created = []
+        with conn:
+            for table_name in tables:
+                created += ensure_bmi_indexes(conn, table_name)
+                if ensure_bmi_fts(conn, table_name):
+                    created.append(f"{table_name}_fts")
+
+            termins = [bmi_table_termin(table_name) for table_name in tables if table_name != ENTRIES_TABLE]
+            if ENTRIES_TABLE in tables:
+                termins += [(termin, statistics) for statistics, termin in
+                            conn.execute(f"SELECT DISTINCT statistics, termin FROM {ENTRIES_TABLE}")]
+            for termin, statistics in termins:
+                if get_termin_stats(conn, termin, statistics) is None:
+                    refresh_termin_stats(conn, termin, statistics)
+                if (statistics, termin) not in catalog:
+                    source = bmi_source(conn, termin, statistics)
+                    last_fetched = conn.execute(f"SELECT MAX(last_updated) FROM {source.table}"
+                                                f"{where_clause(source.where)}", source.params).fetchone()[0]
+                    record_termin_refresh(conn, termin, statistics, last_refresh=last_fetched)
+        if created:
+            # Give the query planner statistics for the new indexes
+            conn.execute('PRAGMA optimize')
+            print(f"Created {len(created)} indexes on {len(tables)} BMI tables")
+        return len(created)
+    finally:
+        conn.close()
+
+
+def migrate_to_entries(db_path):
+    """
+    Move all per-termin BMI tables into the single bmi_entries table, once.
+
+    Every table is copied with its statistics type and termin as part of the
+    key and dropped afterwards, all in one transaction. From then on
+    get_storage_mode reports 'entries' and readers and writers use bmi_entries.
+    The stored hashes, statistics, catalog and change log are keyed by
+    statistics type and termin already and stay as they are.
+
+    Returns:
+        int: Number of rows moved
+    """
+    conn = connect_sqlite(db_path)
+    try:
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
+                  if BMI_TABLE_PATTERN.fullmatch(row[0])]
+        start = time.perf_counter()
+        moved = 0
+        with conn:
+            conn.execute('BEGIN')
+            conn.execute(create_bmi_entries_statement())
+            # The termin column becomes part of the key, so it is set from the table name
+            columns = [row[1] for row in conn.execute(f"PRAGMA table_info({ENTRIES_TABLE})")][1:]
+            values = ', '.join('?' if column == 'termin' else column for column in columns)
+            for table_name in tables:
+                termin, statistics = bmi_table_termin(table_name)
+                cursor = conn.execute(f"INSERT INTO {ENTRIES_TABLE} (statistics, {', '.join(columns)}) "
+                                      f"SELECT ?, {values} FROM {table_name}", (statistics, termin))
+                moved += cursor.rowcount
+                conn.execute(f"DROP TABLE IF EXISTS {table_name}_fts")
+                conn.execute(f"DROP TABLE {table_name}")
+
+            # Indexing once after the copy is faster than maintaining the indexes row by row
+            for _, statement in bmi_index_statements(ENTRIES_TABLE):
+                conn.execute(statement)
+            rebuild_bmi_fts(conn, ENTRIES_TABLE)
+        # Statistics and catalog entries of termins that never had any
+        migrate_bmi_tables(db_path)
+        print(f"Moved {moved} rows from {len(tables)} BMI tables into {ENTRIES_TABLE} "
+              f"in {time.perf_counter() - start:.2f}s")
+        return moved
+    finally:
+        conn.close()
+
+
+def explain_query_plan(conn, query, params=()):
+    """
+    Get the steps of the query plan SQLite chooses for a query.
+
+    SQLite does not re-check the schema for a cached EXPLAIN statement, so
+    use a fresh connection to see indexes created by another connection.
+    """
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+
+
+def fold_case(value):
+    """Lowercase all letters like the trigram search index does, SQLite's lower() only folds ASCII"""
+    return value.lower() if isinstance(value, str) else value
+
+
+def connect_sqlite(db_path, check_same_thread=True):
+    """Open a SQLite connection with the tuning pragmas and the fold_case function applied"""
+    conn = sqlite3.connect(db_path, check_same_thread=check_same_thread)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    conn.create_function('fold_case', 1, fold_case, deterministic=True)
+    return conn
+
+
+sqlite_pools = {}
+sqlite_pools_lock = threading.Lock()
+
+
+@contextmanager
+def sqlite_connection(db_path):
+    """
+    Borrow a tuned connection from the pool of a SQLite database.
+
+    Connections are opened and configured once and reused across requests
+    and threads; rows are returned as sqlite3.Row. An open transaction is
+    committed when the block ends and rolled back if it raises.
+
+    Args:
+        db_path (str): Path to the SQLite database file
+
+    Yields:
+        sqlite3.Connection: Connection reserved for the duration of the block
+    """
+    with sqlite_pools_lock:
+        pool = sqlite_pools.setdefault(db_path, queue.LifoQueue(maxsize=SQLITE_POOL_SIZE))
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = connect_sqlite(db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+
+    try:
+        yield conn
+        if conn.in_transaction:
+            conn.commit()
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        try:
+            pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
 
 
 def connect_to_sql_server(db_config, stage='PROD'):
@@ -70,79 +666,390 @@ def load_sql_data(connection, query):
         return []
 
 
-def insert_into_bmi_table(data_dict, db_path, termin, statistics):
+def bmi_record_params(record_data):
+    """Build the INSERT_BMI_DATA.sql parameter tuple for one merged BMI record"""
+    # Set default values for missing fields
+    return (
+        '',  # abweisen_check_befund_check_beschreibung_extern
+        '',  # abweisen_check_befund_check_beschreibung_kurz
+        '',  # abweisen_check_befund_check_details
+        '',  # abweisen_check_befund_check_gruppe
+        '',  # abweisen_check_befund_check_name
+        record_data.get('anwendungs_id', ''),
+        record_data.get('befoerderungs_datum', ''),
+        record_data.get('blz', ''),
+        record_data.get('comment', ''),
+        record_data.get('datei', ''),
+        record_data.get('datei_id', ''),
+        record_data.get('dateiname', ''),
+        record_data.get('empfangszeit', ''),
+        record_data.get('erstellt', ''),
+        record_data.get('externe_referenz', ''),
+        record_data.get('id1', ''),
+        record_data.get('id2', ''),
+        '',  # import_anwendungs_id
+        '',  # import_befoerderungs_datum
+        '',  # import_blz
+        '',  # import_datei_id
+        '',  # import_dateiname
+        '',  # import_empfangszeit
+        '',  # import_externe_referenz
+        1 if record_data.get('import_found', False) else 0,
+        '',  # import_melder_id
+        '',  # import_melder_id_art
+        '',  # import_meldetermin
+        record_data.get('institutstyp', ''),
+        record_data.get('last_updated', ''),
+        record_data.get('melder_id_bmi', ''),
+        record_data.get('melder_id_art', ''),
+        record_data.get('meldetermin', ''),
+        1 if record_data.get('ok', False) else 0,
+        1 if record_data.get('rejected_import_found', False) else 0,
+        record_data.get('termin', ''),
+        record_data.get('typ', '')
+    )
+
+
+# Positions of comment, last_updated and ok in bmi_record_params; they change
+# without the BMI/importe data changing and are left out of the row hash
+UNHASHED_PARAM_POSITIONS = {8, 29, 33}
+
+
+def bmi_entry_params(params, termin, statistics):
+    """Turn a bmi_record_params tuple into an INSERT_BMI_ENTRIES.sql one, the termin column set from the key"""
+    return (statistics,) + params[:35] + (termin,) + params[36:]
+
+
+def bmi_row_hash(params):
+    """Hash the source data of one bmi_record_params tuple"""
+    values = (str(value) for position, value in enumerate(params) if position not in UNHASHED_PARAM_POSITIONS)
+    return hashlib.blake2b('\x1f'.join(values).encode('utf-8'), digest_size=12).hexdigest()
+
+
+def iter_sql_rows(connection, query, params=(), arraysize=SQL_FETCH_ARRAYSIZE):
+    """
+    Stream the rows of a query as namedtuples, fetching arraysize rows at a time.
+
+    Unlike load_sql_data, the result set is never materialized as a whole and
+    no per-row dict is built; fields are accessed by name (row.datei_id) or
+    by position. Works with pyodbc as well as sqlite3 connections.
+
+    Args:
+        connection: DB-API connection
+        query (str): SQL query
+        params (tuple): Query parameters
+        arraysize (int): Number of rows per fetchmany round trip
+
+    Yields:
+        namedtuple: One row per result record
+    """
+    cursor = connection.cursor()
+    try:
+        if params:
+            cursor.execute(query, params)
+        else:
+            cursor.execute(query)
+        row_type = namedtuple('SqlRow', [column[0] for column in cursor.description], rename=True)
+
+        while True:
+            rows = cursor.fetchmany(arraysize)
+            if not rows:
+                break
+            for row in rows:
+                yield row_type._make(row)
+    finally:
+        cursor.close()
+
+
+def load_sql_index(connection, query, key, params=(), arraysize=SQL_FETCH_ARRAYSIZE):
+    """Stream a query into a dict of rows keyed by the given column, later rows win"""
+    try:
+        index = {}
+        for row in iter_sql_rows(connection, query, params=params, arraysize=arraysize):
+            index[getattr(row, key)] = row
+        return index
+    except Exception as e:
+        print(f"Error executing SQL query: {e}")
+        return {}
+
+
+def lookup_statement(query, key_column, key_count):
+    """Restrict a query to a list of key values, matched against the key column as the query returns it"""
+    placeholders = ', '.join(['?'] * key_count)
+    return f"SELECT * FROM ({query}) AS src WHERE src.[{key_column}] IN ({placeholders})"
+
+
+def load_sql_index_for_keys(connection, query, key, keys, chunk_size=SQL_LOOKUP_CHUNK_SIZE):
     """
-    Insert data from a dictionary into the BMI table with parameterized query.
+    Load only the rows of a query whose key column matches one of the given keys.
+
+    The keys are sent as parameterized IN lists of chunk_size values. The last
+    chunk is padded with a repeated key, so every round trip runs the same
+    prepared statement. Each chunk is answered from an index on the key
+    column, like in the importe mirror; for a computed key column use
+    load_sql_server_index_for_keys instead.
 
     Args:
-        data_dict (dict): Dictionary containing the data to insert
+        connection: DB-API connection
+        query (str): Importe query to restrict
+        key (str): Column the keys are matched against
+        keys: Iterable of key values, e.g. the datei values of a termin
+        chunk_size (int): Number of keys per statement
+
+    Returns:
+        dict: Rows keyed by the key column
+    """
+    keys = sorted(set(keys))
+    if not keys:
+        return {}
+    chunk_size = min(chunk_size, len(keys))
+    statement = lookup_statement(query, key, chunk_size)
+
+    try:
+        index = {}
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+            chunk += [chunk[-1]] * (chunk_size - len(chunk))
+            for row in iter_sql_rows(connection, statement, params=chunk):
+                index[getattr(row, key)] = row
+        return index
+    except Exception as e:
+        print(f"Error executing SQL query: {e}")
+        return {}
+
+
+def load_sql_server_index_for_keys(connection, query, key, keys):
+    """
+    Load only the rows of a SQL Server query whose key column matches one of the given keys.
+
+    The importe queries compute their key column, e.g. the NON_ACS-normalized
+    datei_id, so no index can answer a filter on it and every IN list chunk
+    would scan the source table again. Instead the keys are bulk-loaded into
+    a session temp table and the query is joined against it once, a single
+    scan per run.
+
+    Args:
+        connection: pyodbc connection to SQL Server
+        query (str): Importe query to restrict
+        key (str): Column the keys are matched against
+        keys: Iterable of key values, e.g. the datei values of a termin
+
+    Returns:
+        dict: Rows keyed by the key column
+    """
+    keys = sorted(set(keys))
+    if not keys:
+        return {}
+
+    drop_keys = f"IF OBJECT_ID('tempdb..{SQL_LOOKUP_KEYS_TABLE}') IS NOT NULL DROP TABLE {SQL_LOOKUP_KEYS_TABLE}"
+    cursor = connection.cursor()
+    try:
+        cursor.execute(drop_keys)
+        # The database's collation, tempdb's may differ from the importe columns'
+        cursor.execute(f"CREATE TABLE {SQL_LOOKUP_KEYS_TABLE} ([key] NVARCHAR(1000) COLLATE DATABASE_DEFAULT NOT NULL)")
+        cursor.fast_executemany = True
+        cursor.executemany(f"INSERT INTO {SQL_LOOKUP_KEYS_TABLE} ([key]) VALUES (?)", [(value,) for value in keys])
+
+        index = {}
+        statement = (f"SELECT src.* FROM ({query}) AS src "
+                     f"JOIN {SQL_LOOKUP_KEYS_TABLE} AS lookup ON lookup.[key] = src.[{key}]")
+        for row in iter_sql_rows(connection, statement):
+            index[getattr(row, key)] = row
+        return index
+    except Exception as e:
+        print(f"Error executing SQL query: {e}")
+        return {}
+    finally:
+        try:
+            cursor.execute(drop_keys)
+        except Exception as e:
+            print(f"Error dropping {SQL_LOOKUP_KEYS_TABLE}: {e}")
+        cursor.close()
+
+
+def insert_into_bmi_table(data_dict, db_path, termin, statistics, started_at=None, source_watermark=None):
+    """
+    Upsert all records of a termin into its BMI table in a single transaction.
+
+    The rows are loaded through one prepared statement with executemany. Rows
+    that already exist are updated via ON CONFLICT on their key, which leaves
+    the user-edited comment and ok columns untouched. In entries storage mode
+    the rows go to bmi_entries instead of the termin's own table.
+
+    Args:
+        data_dict (dict): Dictionary containing the data to insert, keyed by id2
         db_path (str): Path to the SQLite database file
+        termin (str): Termin (YYYYMM) selecting the target table
+        statistics (str): Statistics type, 'wpi' or 'emiso'
+        started_at (float): time.time() when the refresh started, for the catalog
+        source_watermark (str): High-watermark of the importe source, for the catalog
+
+    Returns:
+        int: Number of rows written, 0 on error
     """
 
     # Connect to the database
-    conn = sqlite3.connect(db_path)
+    conn = connect_sqlite(db_path)
     cursor = conn.cursor()
 
     try:
-        cursor.execute(create_bmi_table_statement(termin,statistics=statistics))
+        start = time.perf_counter()
+        write_started_at = time.time()
+        cursor.executescript(bmi_changes_statement())
+        cursor.executescript(termin_stats_statement())
+        ensure_termin_catalog(conn)
+        cursor.execute('BEGIN')
+        source = bmi_source(conn, termin, statistics)
+        params = [bmi_record_params(record_data) for record_data in data_dict.values()]
+        if source.table == ENTRIES_TABLE:
+            # The search index covers all termins, so only this termin's rows are re-indexed
+            unindex_bmi_fts_rows(conn, source)
+            cursor.executemany(insert_bmi_entries_statement(),
+                               [bmi_entry_params(record_params, termin, statistics) for record_params in params])
+            index_bmi_fts_rows(conn, source)
+        else:
+            cursor.execute(create_bmi_table_statement(termin, statistics=statistics))
+            ensure_bmi_indexes(conn, source.table)
+            # Re-indexing the whole termin once is several times faster than the per-row triggers
+            drop_bmi_fts_triggers(conn, source.table)
+            # Read the statement once for the whole termin instead of once per record
+            cursor.executemany(insert_bmi_data_statement(termin, statistics=statistics), params)
+            rebuild_bmi_fts(conn, source.table)
+
+        # Keep the stored hashes current so a later incremental refresh diffs against this load
+        cursor.executemany(
+            "INSERT OR REPLACE INTO bmi_row_hashes (statistics, termin, id2, row_hash) VALUES (?, ?, ?, ?)",
+            [(statistics, termin, record_params[16], bmi_row_hash(record_params)) for record_params in params])
+        refresh_termin_stats(conn, termin, statistics)
+        record_termin_refresh(conn, termin, statistics, time.time() - (started_at or write_started_at),
+                              source_watermark)
         conn.commit()
-        for record_id, record_data in data_dict.items():
-            # Get the termin value for table name formatting
-            termin = record_data.get('termin', '')
-
-            # Format the SQL statement with the termin value
-            sql_statement = insert_bmi_data_statement(termin, statistics=statistics)
-
-            # Prepare the parameters for the SQL statement
-            # Set default values for missing fields
-            params = [
-                '',  # abweisen_check_befund_check_beschreibung_extern
-                '',  # abweisen_check_befund_check_beschreibung_kurz
-                '',  # abweisen_check_befund_check_details
-                '',  # abweisen_check_befund_check_gruppe
-                '',  # abweisen_check_befund_check_name
-                record_data.get('anwendungs_id', ''),
-                record_data.get('befoerderungs_datum', ''),
-                record_data.get('blz', ''),
-                record_data.get('comment', ''),
-                record_data.get('datei', ''),
-                record_data.get('datei_id', ''),
-                record_data.get('dateiname', ''),
-                record_data.get('empfangszeit', ''),
-                record_data.get('erstellt', ''),
-                record_data.get('externe_referenz', ''),
-                record_data.get('id1', ''),
-                record_data.get('id2', ''),
-                '',  # import_anwendungs_id
-                '',  # import_befoerderungs_datum
-                '',  # import_blz
-                '',  # import_datei_id
-                '',  # import_dateiname
-                '',  # import_empfangszeit
-                '',  # import_externe_referenz
-                1 if record_data.get('import_found', False) else 0,
-                '',  # import_melder_id
-                '',  # import_melder_id_art
-                '',  # import_meldetermin
-                record_data.get('institutstyp', ''),
-                record_data.get('last_updated', ''),
-                record_data.get('melder_id_bmi', ''),
-                record_data.get('melder_id_art', ''),
-                record_data.get('meldetermin', ''),
-                1 if record_data.get('ok', False) else 0,
-                1 if record_data.get('rejected_import_found', False) else 0,
-                record_data.get('termin', ''),
-                record_data.get('typ', '')
-            ]
-
-            # Execute the SQL statement
-            cursor.execute(sql_statement, params)
-
-            # Commit the transaction
+
+        elapsed = time.perf_counter() - start
+        row_count = len(data_dict)
+        print(f"Successfully upserted {row_count} rows for {termin} in {statistics} "
+              f"in {elapsed:.3f}s ({row_count / max(elapsed, 1e-9):.0f} rows/s)")
+        return row_count
+    except sqlite3.Error as e:
+        print(f"SQLite error: {e}")
+        conn.rollback()
+        return 0
+    finally:
+        conn.close()
+
+
+def sync_bmi_table(data_dict, db_path, termin, statistics, started_at=None, source_watermark=None, complete=True):
+    """
+    Incrementally apply a refreshed termin to its BMI table, or its rows in
+    bmi_entries in entries storage mode.
+
+    Every merged record is hashed and compared against the hashes stored by
+    the previous refresh in a single pass. Only inserted and changed rows are
+    written and rows that disappeared from BMI are deleted; each of them is
+    logged to bmi_changes, so the cost scales with churn instead of table size.
+    Rows with a comment or marked OK are never deleted, and nothing is
+    deleted if the fetched list may have been capped.
+
+    Args:
+        data_dict (dict): Dictionary containing the merged records, keyed by id2
+        db_path (str): Path to the SQLite database file
+        termin (str): Termin (YYYYMM) selecting the target table
+        statistics (str): Statistics type, 'wpi' or 'emiso'
+        started_at (float): time.time() when the refresh started, for the catalog
+        source_watermark (str): High-watermark of the importe source, for the catalog
+        complete (bool): False if data_dict may miss rows BMI still reports, e.g. a capped unpaged fetch
+
+    Returns:
+        dict: Number of inserted, changed, removed and unchanged rows, None on error
+    """
+    conn = connect_sqlite(db_path)
+    cursor = conn.cursor()
+
+    changed_at = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    try:
+        start = time.perf_counter()
+        write_started_at = time.time()
+        cursor.executescript(bmi_changes_statement())
+        cursor.executescript(termin_stats_statement())
+        ensure_termin_catalog(conn)
+        cursor.execute('BEGIN')
+        source = bmi_source(conn, termin, statistics)
+        if source.table != ENTRIES_TABLE:
+            cursor.execute(create_bmi_table_statement(termin, statistics=statistics))
+            ensure_bmi_indexes(conn, source.table)
+            ensure_bmi_fts(conn, source.table)
+
+        # Rows loaded before hashes were tracked come back with a NULL hash
+        cursor.execute(f"""
+            SELECT t.id2, t.datei, h.row_hash, COALESCE(t.comment, '') != '' OR t.ok = 1 FROM {source.table} t
+            LEFT JOIN bmi_row_hashes h ON h.statistics = ? AND h.termin = ? AND h.id2 = t.id2
+            {where_clause([f"t.{clause}" for clause in source.where])}
+        """, (statistics, termin, *source.params))
+        stored = {id2: (datei, row_hash, edited) for id2, datei, row_hash, edited in cursor}
+
+        upserts = []
+        hashes = []
+        changes = []
+        counts = {'inserted': 0, 'changed': 0, 'removed': 0, 'unchanged': 0}
+        for id2, record_data in data_dict.items():
+            params = bmi_record_params(record_data)
+            row_hash = bmi_row_hash(params)
+            old_datei, old_hash, _ = stored.pop(id2, (None, None, False))
+            if old_hash == row_hash:
+                counts['unchanged'] += 1
+                continue
+
+            upserts.append(params)
+            hashes.append((statistics, termin, id2, row_hash))
+            if old_datei is None:
+                change = 'inserted'
+            elif old_hash is not None:
+                change = 'changed'
+            else:
+                # Untracked row: rewrite it once, but it is not a real change
+                continue
+            counts[change] += 1
+            changes.append((statistics, termin, id2, record_data.get('datei', ''), change, changed_at))
+
+        # Whatever is left in the table was not reported by BMI any more, unless the list was capped.
+        # A row the user commented on or marked OK is kept with its edits either way.
+        gone = {id2: old_datei for id2, (old_datei, _, edited) in stored.items() if complete and not edited}
+        if len(gone) < len(stored):
+            print(f"Keeping {len(stored) - len(gone)} rows of {termin} that are missing from the fetched list"
+                  + ("" if complete else ", it may be capped"))
+        removed = [(*source.params, id2) for id2 in gone]
+        for id2, old_datei in gone.items():
+            changes.append((statistics, termin, id2, old_datei, 'removed', changed_at))
+        counts['removed'] = len(removed)
+
+        if source.table == ENTRIES_TABLE:
+            cursor.executemany(insert_bmi_entries_statement(),
+                               [bmi_entry_params(record_params, termin, statistics) for record_params in upserts])
+        else:
+            cursor.executemany(insert_bmi_data_statement(termin, statistics=statistics), upserts)
+        cursor.executemany(
+            "INSERT OR REPLACE INTO bmi_row_hashes (statistics, termin, id2, row_hash) VALUES (?, ?, ?, ?)", hashes)
+        cursor.executemany(f"DELETE FROM {source.table}{where_clause(source.where + ['id2 = ?'])}", removed)
+        cursor.executemany(
+            "DELETE FROM bmi_row_hashes WHERE statistics = ? AND termin = ? AND id2 = ?",
+            [(statistics, termin, id2) for id2 in gone])
+        cursor.executemany(
+            "INSERT INTO bmi_changes (statistics, termin, id2, datei, change, changed_at) VALUES (?, ?, ?, ?, ?, ?)",
+            changes)
+        refresh_termin_stats(conn, termin, statistics)
+        record_termin_refresh(conn, termin, statistics, time.time() - (started_at or write_started_at),
+                              source_watermark)
         conn.commit()
-        print(f"Successfully inserted data for {termin} in {statistics}")
+
+        elapsed = time.perf_counter() - start
+        print(f"Incremental refresh of {termin} in {statistics} in {elapsed:.3f}s: "
+              f"{counts['inserted']} inserted, {counts['changed']} changed, "
+              f"{counts['removed']} removed, {counts['unchanged']} unchanged")
+        return counts
     except sqlite3.Error as e:
         print(f"SQLite error: {e}")
         conn.rollback()
+        return None
     finally:
         conn.close()
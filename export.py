@@ -0,0 +1,110 @@
+import io
+import csv
+import json
+import zlib
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet export is optional
+    pyarrow = None
+
+EXPORT_BATCH_SIZE = 5000  # Rows fetched from SQLite and serialized per chunk
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+# Flag columns exported as integers to Parquet, all others are text like in the BMI tables
+INTEGER_COLUMNS = ('import_found', 'rejected_import_found', 'ok')
+
+
+def iter_batches(cursor, batch_size=EXPORT_BATCH_SIZE):
+    """Yield the rows of an executed cursor batch_size rows at a time"""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+
+
+def iter_csv(columns, batches):
+    """Serialize row batches as CSV with a header line, one chunk per batch"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def iter_ndjson(columns, batches):
+    """Serialize row batches as one JSON object per line, one chunk per batch"""
+    for rows in batches:
+        yield ''.join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows).encode('utf-8')
+
+
+class ChunkSink(io.RawIOBase):
+    """Write-only file that keeps what was written until drain() takes it"""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_parquet(columns, batches):
+    """Serialize row batches as a Parquet file, one row group and chunk per batch"""
+    schema = pyarrow.schema([(column, pyarrow.int64() if column in INTEGER_COLUMNS else pyarrow.string())
+                             for column in columns])
+    sink = ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd')
+    for rows in batches:
+        arrays = [pyarrow.array([row[i] for row in rows], type=field.type) for i, field in enumerate(schema)]
+        writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def serialize(format, columns, batches):
+    """Serialize row batches in an EXPORT_FORMATS format, raises ValueError if it is unknown or unavailable"""
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid export format {format!r}")
+    if format == 'parquet':
+        if pyarrow is None:
+            raise ValueError("Parquet export needs pyarrow, install it with pip install pyarrow")
+        return iter_parquet(columns, batches)
+    if format == 'ndjson':
+        return iter_ndjson(columns, batches)
+    return iter_csv(columns, batches)
+
+
+def gzip_chunks(chunks, level=6):
+    """Compress a stream of byte chunks into one gzip stream"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
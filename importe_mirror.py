@@ -0,0 +1,210 @@
+import sqlite3
+import datetime
+import time
+import db_utils
+
+MIRROR_DB_PATH = 'importe_mirror.db'
+RECONCILE_AFTER_DAYS = 7  # Reload a mirror completely once its last full sync is older than this
+
+# Key column and high-watermark column of each mirrored source
+MIRROR_SOURCES = {
+    'importe': ('datei_id', 'empfangszeit'),
+    'abgewiesen': ('import_datei_id', 'import_empfangszeit'),
+}
+
+
+def mirror_table_name(statistics, source):
+    return f"{source}_{statistics}"
+
+
+def source_statement(statistics, source, cut_date):
+    """Get the SQL Server query a mirror is filled from"""
+    if source == 'importe':
+        return db_utils.importe_statement(statistics, cut_date)
+    return db_utils.importe_abgewiesen_statement(statistics, cut_date)
+
+
+def delta_statement(query, watermark_column):
+    """Restrict a source query to the rows at or after the watermark"""
+    return f"SELECT * FROM ({query}) AS src WHERE src.[{watermark_column}] >= ?"
+
+
+def watermark_parameter(watermark):
+    """Turn a stored watermark back into a value SQL Server compares as a date"""
+    try:
+        return datetime.datetime.fromisoformat(watermark)
+    except ValueError:
+        return watermark
+
+
+def ensure_state_table(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS mirror_state (
+        name TEXT PRIMARY KEY,
+        cut_date TEXT,
+        watermark TEXT,
+        last_full_sync TEXT,
+        last_sync TEXT
+    )
+    """)
+
+
+def needs_full_sync(state, cut_date, now):
+    if state is None:
+        return True
+    state_cut_date, _, last_full_sync = state
+    if state_cut_date != cut_date or not last_full_sync:
+        return True
+    last_full = datetime.datetime.strptime(last_full_sync, '%Y-%m-%d %H:%M:%S')
+    return now - last_full > datetime.timedelta(days=RECONCILE_AFTER_DAYS)
+
+
+def sync_source(sql_conn, conn, statistics, source, cut_date, full=False):
+    """
+    Bring one local mirror table up to date with its SQL Server source.
+
+    The importe tables are only appended to, so a regular sync fetches the
+    rows from the stored watermark onwards. Rows at exactly the watermark are
+    replaced, which keeps rows that arrived with the same timestamp after
+    the last sync. A full reload runs on the first sync, after a cut date
+    change and every RECONCILE_AFTER_DAYS days.
+
+    Args:
+        sql_conn: pyodbc connection to SQL Server
+        conn: sqlite3 connection to the mirror database
+        statistics (str): Statistics type, 'wpi' or 'emiso'
+        source (str): 'importe' or 'abgewiesen'
+        cut_date (str): Import cut date (YYYYMMDD)
+        full (bool): Force a full reload
+
+    Returns:
+        int: Number of rows fetched from SQL Server
+    """
+    key_column, watermark_column = MIRROR_SOURCES[source]
+    table_name = mirror_table_name(statistics, source)
+    now = datetime.datetime.now().replace(microsecond=0)
+
+    ensure_state_table(conn)
+    state = conn.execute("SELECT cut_date, watermark, last_full_sync FROM mirror_state WHERE name = ?",
+                         (table_name,)).fetchone()
+    table_exists = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name = ?",
+                                (table_name,)).fetchone() is not None
+    # Without a watermark there is nothing to continue from
+    full = full or not table_exists or needs_full_sync(state, cut_date, now) or state[1] is None
+
+    query = source_statement(statistics, source, cut_date)
+    if full:
+        rows = db_utils.iter_sql_rows(sql_conn, query)
+    else:
+        rows = db_utils.iter_sql_rows(sql_conn, delta_statement(query, watermark_column),
+                                      params=(watermark_parameter(state[1]),))
+
+    start = time.perf_counter()
+    row_count = 0
+    insert_statement = None
+    try:
+        conn.execute('BEGIN')
+        if full:
+            conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+        else:
+            conn.execute(f"DELETE FROM {table_name} WHERE {watermark_column} = ?", (state[1],))
+
+        batch = []
+        for row in rows:
+            if insert_statement is None:
+                # The mirror takes its columns from the query, all stored as text like the matched values
+                columns = ', '.join(f'"{field}" TEXT' for field in row._fields)
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({columns})")
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {table_name}_{key_column} ON {table_name} ({key_column})")
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {table_name}_{watermark_column} "
+                             f"ON {table_name} ({watermark_column})")
+                insert_statement = f"INSERT INTO {table_name} VALUES ({', '.join(['?'] * len(row._fields))})"
+
+            batch.append(tuple(value if value is None or isinstance(value, str) else str(value) for value in row))
+            if len(batch) >= db_utils.SQL_FETCH_ARRAYSIZE:
+                conn.executemany(insert_statement, batch)
+                row_count += len(batch)
+                batch = []
+        if batch:
+            conn.executemany(insert_statement, batch)
+            row_count += len(batch)
+
+        table_exists = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name = ?",
+                                    (table_name,)).fetchone() is not None
+        watermark = None
+        if table_exists:
+            watermark = conn.execute(f"SELECT MAX({watermark_column}) FROM {table_name}").fetchone()[0]
+
+        synced_at = now.strftime('%Y-%m-%d %H:%M:%S')
+        last_full_sync = synced_at if full else state[2]
+        conn.execute("INSERT OR REPLACE INTO mirror_state (name, cut_date, watermark, last_full_sync, last_sync) "
+                     "VALUES (?, ?, ?, ?, ?)", (table_name, cut_date, watermark, last_full_sync, synced_at))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    print(f"{'Full' if full else 'Delta'} sync of {table_name}: {row_count} rows "
+          f"in {time.perf_counter() - start:.2f}s, watermark {watermark}")
+    return row_count
+
+
+def sync_mirror(sql_conn, statistics, cut_date, db_path=MIRROR_DB_PATH, full=False):
+    """Sync the importe and abgewiesen mirrors of a statistics type, True on success"""
+    conn = sqlite3.connect(db_path)
+    try:
+        for source in MIRROR_SOURCES:
+            sync_source(sql_conn, conn, statistics, source, cut_date, full=full)
+        return True
+    except Exception as e:
+        print(f"Error syncing importe mirror: {e}")
+        return False
+    finally:
+        conn.close()
+
+
+def get_mirror_watermark(statistics, source='importe', db_path=MIRROR_DB_PATH):
+    """Get the high-watermark of a mirror, None if it was never synced"""
+    conn = sqlite3.connect(db_path)
+    try:
+        ensure_state_table(conn)
+        row = conn.execute("SELECT watermark FROM mirror_state WHERE name = ?",
+                           (mirror_table_name(statistics, source),)).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def load_mirror_index(statistics, source, keys=None, db_path=MIRROR_DB_PATH):
+    """
+    Load a mirror as a dict keyed by its key column, without touching SQL Server.
+
+    Args:
+        statistics (str): Statistics type, 'wpi' or 'emiso'
+        source (str): 'importe' or 'abgewiesen'
+        keys: Optional iterable of key values to restrict the lookup to
+        db_path (str): Path to the mirror database
+
+    Returns:
+        dict: Mirrored rows keyed by the key column, None if the mirror was never synced
+    """
+    key_column, _ = MIRROR_SOURCES[source]
+    table_name = mirror_table_name(statistics, source)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        ensure_state_table(conn)
+        if conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name = ?",
+                        (table_name,)).fetchone() is None:
+            # A sync that found no rows records its state but creates no table
+            if conn.execute("SELECT name FROM mirror_state WHERE name = ?", (table_name,)).fetchone() is None:
+                print(f"Mirror {table_name} has not been synced yet.")
+                return None
+            return {}
+
+        query = f"SELECT * FROM {table_name}"
+        if keys is not None:
+            return db_utils.load_sql_index_for_keys(conn, query, key=key_column, keys=keys)
+        return db_utils.load_sql_index(conn, query, key=key_column)
+    finally:
+        conn.close()
@@ -0,0 +1,177 @@
+import threading
+import queue
+import uuid
+import datetime
+from process_data import process_data
+import db_utils
+
+DB_PATH = 'bmi_data.db'
+
+# Jobs that are queued or running in this process, keyed by (termin, statistics)
+active_jobs = {}
+active_jobs_lock = threading.Lock()
+job_queue = queue.Queue()
+worker_thread = None
+# Cleared by shutdown(), after that no new refreshes are queued
+accepting = True
+
+
+def now():
+    return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def initialize_jobs_table():
+    """Create the jobs table and fail jobs that were interrupted by a restart"""
+    with db_utils.sqlite_connection(DB_PATH) as conn:
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            termin TEXT,
+            statistics TEXT,
+            status TEXT,
+            stage TEXT,
+            rows INTEGER,
+            error TEXT,
+            created_at TEXT,
+            started_at TEXT,
+            finished_at TEXT
+        )
+        ''')
+        conn.execute("UPDATE jobs SET status = 'failed', error = 'Interrupted by a server restart', finished_at = ? "
+                     "WHERE status IN ('queued', 'running')", (now(),))
+
+
+def update_job(job_id, **fields):
+    assignments = ', '.join(f"{column} = ?" for column in fields)
+    with db_utils.sqlite_connection(DB_PATH) as conn:
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+
+def get_job(job_id):
+    """Get the state of a refresh job, None if the id is unknown"""
+    with db_utils.sqlite_connection(DB_PATH) as conn:
+        # Read-only: before the first refresh of a new database there is no jobs table yet
+        if conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name = 'jobs'").fetchone() is None:
+            return None
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+
+    job = {key: row[key] for key in row.keys()}
+    job['elapsed_seconds'] = None
+    if job['started_at']:
+        started = datetime.datetime.strptime(job['started_at'], '%Y-%m-%d %H:%M:%S')
+        finished = (datetime.datetime.strptime(job['finished_at'], '%Y-%m-%d %H:%M:%S')
+                    if job['finished_at'] else datetime.datetime.now())
+        job['elapsed_seconds'] = int((finished - started).total_seconds())
+    return job
+
+
+def submit_refresh(termin, statistics, options=None):
+    """
+    Queue a refresh of one termin and return (job id, attached).
+
+    A request for a termin and statistics type that is already queued or
+    running attaches to that job instead of starting a second refresh.
+
+    Args:
+        termin (str): Termin (YYYYMM) to refresh
+        statistics (str): Statistics type, 'wpi' or 'emiso'
+        options (dict): Keyword arguments for process_data, e.g. incremental
+
+    Returns:
+        tuple: (job id, True if an existing job was returned)
+    """
+    ensure_worker()
+    with active_jobs_lock:
+        job_id = active_jobs.get((termin, statistics))
+        if job_id:
+            return job_id, True
+        if not accepting:
+            raise RuntimeError("The server is shutting down, try again once it is back")
+
+        job_id = uuid.uuid4().hex
+        with db_utils.sqlite_connection(DB_PATH) as conn:
+            conn.execute("INSERT INTO jobs (id, termin, statistics, status, stage, rows, created_at) "
+                         "VALUES (?, ?, ?, 'queued', NULL, 0, ?)", (job_id, termin, statistics, now()))
+
+        active_jobs[(termin, statistics)] = job_id
+        job_queue.put((job_id, termin, statistics, options or {}))
+    return job_id, False
+
+
+def run_job(job_id, termin, statistics, options):
+    update_job(job_id, status='running', started_at=now())
+
+    def progress(stage, rows):
+        update_job(job_id, stage=stage, rows=rows or 0)
+
+    try:
+        rows = process_data(termin, statistics, progress=progress, **options)
+        if rows:
+            update_job(job_id, status='finished', stage='done', rows=rows, finished_at=now())
+        else:
+            update_job(job_id, status='failed', error='No data was imported, see the server log',
+                       finished_at=now())
+    except Exception as e:
+        update_job(job_id, status='failed', error=str(e), finished_at=now())
+    finally:
+        with active_jobs_lock:
+            active_jobs.pop((termin, statistics), None)
+
+
+def work():
+    # A single worker keeps refreshes from competing for the bmi_data.db write lock
+    while True:
+        job = job_queue.get()
+        if job is None:  # Put by shutdown() behind the last queued job
+            job_queue.task_done()
+            break
+        try:
+            run_job(*job)
+        finally:
+            job_queue.task_done()
+
+
+def ensure_worker():
+    global worker_thread
+    with active_jobs_lock:
+        if worker_thread is None:
+            initialize_jobs_table()
+            worker_thread = threading.Thread(target=work, name='refresh-worker', daemon=True)
+            worker_thread.start()
+
+
+def get_status():
+    """Get whether new refreshes are accepted and how many are queued or running"""
+    with active_jobs_lock:
+        return {'accepting': accepting, 'active_jobs': len(active_jobs)}
+
+
+def stop_accepting():
+    """Refuse new refreshes from now on, the queued and running ones still finish"""
+    global accepting
+    with active_jobs_lock:
+        accepting = False
+
+
+def shutdown(timeout=None):
+    """
+    Stop accepting refreshes and wait for the queued and running ones to finish.
+
+    Args:
+        timeout (float): Seconds to wait at most, None waits until they are done
+
+    Returns:
+        bool: True if no refresh is left unfinished
+    """
+    global accepting
+    with active_jobs_lock:
+        accepting = False
+        thread = worker_thread
+        if thread is not None:
+            job_queue.put(None)
+    if thread is None:
+        return True
+    thread.join(timeout)
+    return not thread.is_alive()
@@ -1,71 +1,99 @@
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from html.parser import HTMLParser
+import codecs
 import datetime
 import utils
 
 BMI_URL = 'https://bmi-login.inet.bundesbank.de/bmi/MeldungList.do?value(action)=aktion.gruppe.3&value(nformat)=0'
 AUTH_FILE_PATH = r"C:\Users\s1504nn\auth_wpi.yml"
+STREAM_CHUNK_SIZE = 64 * 1024
+REQUEST_TIMEOUT = (10, 300)  # Connect and read timeout in seconds
+BMI_LIST_SIZE = 5000  # Maximum value(nlistsize) accepted by MeldungList.do
+BMI_PAGE_FIELD = 'value(npage)'  # Form field selecting the result page in paged mode
+BMI_MAX_PAGES = 200
+FETCH_WORKERS = 4
+PARSE_PROGRESS_ROWS = 1000  # Rows parsed between two progress reports
 
-def fetch_bmi_data(termin,sachgebiet):
+BMI_HEADERS = {
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+    'Accept-Language': 'ru,de;q=0.9,de-DE;q=0.8,en;q=0.7,en-GB;q=0.6,en-US;q=0.5',
+    'Cache-Control': 'max-age=0',
+    'Connection': 'keep-alive',
+    'Content-Type': 'application/x-www-form-urlencoded',
+    'Origin': 'https://bmi-login.inet.bundesbank.de',
+    'Referer': 'https://bmi-login.inet.bundesbank.de/bmi/MeldungFinder.do?value(action)=aktion.gruppe.2',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'same-origin',
+    'Sec-Fetch-User': '?1',
+    'Upgrade-Insecure-Requests': '1',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36 Edg/134.0.0.0',
+    'sec-ch-ua': '"Chromium";v="134", "Not:A-Brand";v="24", "Microsoft Edge";v="134"',
+    'sec-ch-ua-mobile': '?0',
+    'sec-ch-ua-platform': '"Windows"'
+}
+
+# Elements without an end tag, they never enclose table cells
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source',
+                 'track', 'wbr'}
+
+
+def bmi_form_data(termin, sachgebiet, page=None, list_size=BMI_LIST_SIZE):
+    # Prepare form data based on request.txt
+    data = {
+        'value(nisfinder)': 'true',
+        'value(nismeldungkeys)': '',
+        'auswahl(isachgebiet)': sachgebiet,
+        'value(aelz)': '',
+        'value(alieferung)': '',
+        'value(ntest)': 'cb.all',
+        'value(nlieferungstatus)': 'cb.all',
+        'value(teingang_von)': '',
+        'value(teingang_bis)': '',
+        'value(nabholstatus)': 'cb.all',
+        'value(ntyp_identnr)': '1',
+        'value(alz)': '',
+        'auswahl(itermin)': termin,  # Using the passed parameter instead of hardcoded value
+        'value(ntyp)': 'cb.all',
+        'value(nlistsize)': str(list_size)
+    }
+    if page is not None:
+        data[BMI_PAGE_FIELD] = str(page)
+    return data
+
+
+def load_bmi_auth():
     auth_config = utils.load_yaml_config(AUTH_FILE_PATH)
     if not auth_config:
         print("Failed to load authentication configuration.")
-        return
+        return None
+    return auth_config['credentials']['username'], auth_config['credentials']['password']
+
+
+def post_bmi_request(termin, sachgebiet, stream=False):
     try:
-        username = auth_config['credentials']['username']
-        password = auth_config['credentials']['password']
-
-        headers = {
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-            'Accept-Language': 'ru,de;q=0.9,de-DE;q=0.8,en;q=0.7,en-GB;q=0.6,en-US;q=0.5',
-            'Cache-Control': 'max-age=0',
-            'Connection': 'keep-alive',
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'Origin': 'https://bmi-login.inet.bundesbank.de',
-            'Referer': 'https://bmi-login.inet.bundesbank.de/bmi/MeldungFinder.do?value(action)=aktion.gruppe.2',
-            'Sec-Fetch-Dest': 'document',
-            'Sec-Fetch-Mode': 'navigate',
-            'Sec-Fetch-Site': 'same-origin',
-            'Sec-Fetch-User': '?1',
-            'Upgrade-Insecure-Requests': '1',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36 Edg/134.0.0.0',
-            'sec-ch-ua': '"Chromium";v="134", "Not:A-Brand";v="24", "Microsoft Edge";v="134"',
-            'sec-ch-ua-mobile': '?0',
-            'sec-ch-ua-platform': '"Windows"'
-        }
-
-        # Prepare form data based on request.txt
-        data = {
-            'value(nisfinder)': 'true',
-            'value(nismeldungkeys)': '',
-            'auswahl(isachgebiet)': sachgebiet,
-            'value(aelz)': '',
-            'value(alieferung)': '',
-            'value(ntest)': 'cb.all',
-            'value(nlieferungstatus)': 'cb.all',
-            'value(teingang_von)': '',
-            'value(teingang_bis)': '',
-            'value(nabholstatus)': 'cb.all',
-            'value(ntyp_identnr)': '1',
-            'value(alz)': '',
-            'auswahl(itermin)': termin,  # Using the passed parameter instead of hardcoded value
-            'value(ntyp)': 'cb.all',
-            'value(nlistsize)': '5000'
-        }
+        auth = load_bmi_auth()
+        if not auth:
+            return None
 
         # Make the request with BasicAuth and SSL verification disabled
         response = requests.post(
             BMI_URL,
-            headers=headers,
-            data=data,
-            auth=(username, password),
-            verify=False
+            headers=BMI_HEADERS,
+            data=bmi_form_data(termin, sachgebiet),
+            auth=auth,
+            verify=False,
+            stream=stream,
+            timeout=REQUEST_TIMEOUT
         )
 
         if response.status_code == 200:
-            return response.text
+            return response
         else:
             print(f"Error fetching data: Status code {response.status_code}")
+            response.close()
             return None
 
     except Exception as e:
@@ -73,85 +101,319 @@ def fetch_bmi_data(termin,sachgebiet):
         return None
 
 
-# Function to parse HTML response
-def parse_bmi_html(html_content):
-    bmi_dict = {}
-    try:
-        soup = BeautifulSoup(html_content, 'html.parser')
+def fetch_bmi_data(termin,sachgebiet):
+    response = post_bmi_request(termin, sachgebiet)
+    if response is None:
+        return None
+    return response.text
+
+
+def fetch_bmi_stream(termin, sachgebiet):
+    """Fetch the BMI report list as a stream of raw byte chunks and their encoding"""
+    response = post_bmi_request(termin, sachgebiet, stream=True)
+    if response is None:
+        return None, None
+    return response.iter_content(chunk_size=STREAM_CHUNK_SIZE), response.encoding or 'utf-8'
 
-        # Find all rows in the table
-        rows = soup.find_all('tr')
 
-        for row in rows:
-            # Find all cells in the row
-            cells = row.find_all('td')
+def bmi_row(checkbox_value, cell_texts, last_updated):
+    """Build the row dict for one report table row, None if it is not a report row"""
+    ids = checkbox_value.split('##')
+    if len(ids) != 2:
+        return None
+    id1, id2 = ids
+
+    return {
+        'id1': id1,
+        'id2': id2,
+        'melder_id_bmi': cell_texts[1].strip(),
+        'institutstyp': cell_texts[2].strip(),
+        'termin': cell_texts[3].strip(),
+        'datei': cell_texts[4].strip().replace('.zip_', '.zip - '),
+        'erstellt': cell_texts[5].strip(),
+        'typ': cell_texts[6].strip(),
+        'import_found': False,
+        'rejected_import_found': False,
+        'comment': '',  # Added new column
+        'ok': False,  # Added new column
+        'last_updated': last_updated  # Added timestamp
+    }
+
+
+class BmiRowParser(HTMLParser):
+    """
+    Incremental tag-event parser for the BMI MeldungList.do table.
+
+    Only the open elements and the text of open cells are kept in memory; each
+    table row is turned into a row dict as soon as its end tag arrives. Tags
+    are nested the same way BeautifulSoup's html.parser builder nests them, so
+    a row sees every <td> below it and a cell's text includes nested elements.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.last_updated = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.rows = []
+        # Stack of (tag, state) for the open elements; state is a row or a cell
+        self.open_elements = []
+        self.open_rows = []
+        self.open_cells = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'input':
+            self.handle_input(attrs)
+        if tag in VOID_ELEMENTS:
+            return
+
+        state = None
+        if tag == 'tr':
+            # [cells, checkbox value or None, checkbox seen]
+            state = [[], None, False]
+            self.open_rows.append(state)
+        elif tag == 'td':
+            state = []
+            for row in self.open_rows:
+                row[0].append(state)
+            self.open_cells.append(state)
+        self.open_elements.append((tag, state))
 
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        # Like BeautifulSoup, an end tag closes everything opened after its start tag
+        # and an end tag without a matching open element is ignored
+        for position in range(len(self.open_elements) - 1, -1, -1):
+            if self.open_elements[position][0] == tag:
+                break
+        else:
+            return
+        while len(self.open_elements) > position:
+            self.close_element(*self.open_elements.pop())
+
+    def handle_data(self, data):
+        for cell in self.open_cells:
+            cell.append(data)
+
+    def handle_input(self, attrs):
+        attributes = dict(attrs)
+        if attributes.get('type') != 'checkbox':
+            return
+        for row in self.open_rows:
+            # Only the first checkbox inside the first cell of a row counts
+            if not row[2] and row[0] and any(row[0][0] is cell for cell in self.open_cells):
+                # A checkbox without a value attribute disqualifies the row
+                if 'value' in attributes:
+                    row[1] = attributes['value'] or ''
+                row[2] = True
+
+    def close_element(self, tag, state):
+        if tag == 'td':
+            self.open_cells.pop()
+        elif tag == 'tr':
+            self.open_rows.pop()
+            cells, checkbox_value, _ = state
             # Only process rows with the correct number of cells (table data rows)
-            if len(cells) == 8:  # Adjust based on the actual table structure
-                try:
-                    # Extract checkbox value (ID1##ID2)
-                    checkbox = cells[0].find('input', type='checkbox')
-                    if checkbox and 'value' in checkbox.attrs:
-                        value = checkbox['value']
-                        ids = value.split('##')
-                        if len(ids) == 2:
-                            id1 = ids[0]
-                            id2 = ids[1]
-
-                            # Extract other cell values
-                            melder_id = cells[1].text.strip()
-                            institutstyp = cells[2].text.strip()
-                            termin = cells[3].text.strip()
-                            datei = cells[4].text.strip()
-                            erstellt = cells[5].text.strip()
-                            typ = cells[6].text.strip()
-
-                            # Store in dictionary with id2 as key
-                            bmi_dict[id2] = {
-                                'id1': id1,
-                                'id2': id2,
-                                'melder_id_bmi': melder_id,
-                                'institutstyp': institutstyp,
-                                'termin': termin,
-                                'datei': datei.replace('.zip_', '.zip - '),
-                                'erstellt': erstellt,
-                                'typ': typ,
-                                'import_found': False,
-                                'rejected_import_found': False,
-                                'comment': '',  # Added new column
-                                'ok': False,  # Added new column
-                                'last_updated': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')  # Added timestamp
-                            }
-                except Exception as e:
-                    print(f"Error parsing row: {e}")
+            if len(cells) == 8 and checkbox_value is not None:
+                row = bmi_row(checkbox_value, [''.join(cell) for cell in cells], self.last_updated)
+                if row:
+                    self.rows.append(row)
+
+    def close(self):
+        super().close()
+        while self.open_elements:
+            self.close_element(*self.open_elements.pop())
+
+    def pop_rows(self):
+        rows = self.rows
+        self.rows = []
+        return rows
+
+
+def iter_bmi_rows(chunks, encoding='utf-8'):
+    """
+    Parse BMI report rows from an iterable of HTML chunks.
+
+    Args:
+        chunks: Iterable of str or bytes chunks, e.g. a response's iter_content()
+        encoding (str): Encoding used to decode bytes chunks
+
+    Yields:
+        dict: One row dict (id1, id2, melder_id_bmi, datei, ...) per report row
+    """
+    parser = BmiRowParser()
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        parser.feed(chunk)
+        yield from parser.pop_rows()
+
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    yield from parser.pop_rows()
+
+
+def create_bmi_session(auth, pool_size=FETCH_WORKERS):
+    """Create a keep-alive session whose connection pool fits pool_size concurrent requests"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update(BMI_HEADERS)
+    session.auth = auth
+    session.verify = False
+    return session
+
+
+def fetch_bmi_page(session, url, termin, sachgebiet, page, page_size):
+    """Fetch one result page and parse it while the body is arriving"""
+    data = bmi_form_data(termin, sachgebiet, page=page, list_size=page_size)
+    with session.post(url, data=data, stream=True, timeout=REQUEST_TIMEOUT) as response:
+        response.raise_for_status()
+        chunks = response.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+        return list(iter_bmi_rows(chunks, encoding=response.encoding or 'utf-8'))
+
+
+def iter_bmi_pages(termin, sachgebiet, url=BMI_URL, auth=None, max_workers=FETCH_WORKERS,
+                   page_size=BMI_LIST_SIZE):
+    """
+    Fetch all result pages of a termin with a bounded number of concurrent requests.
+
+    Pages are requested over one pooled keep-alive session, at most
+    max_workers at a time. The next page is requested as soon as one finishes,
+    until a page comes back with fewer than page_size rows. Rows are yielded
+    in the order the pages complete.
+
+    Args:
+        termin (str): Termin (YYYYMM) to fetch
+        sachgebiet (str): BMI Sachgebiet, '14' for WPI and '17' for EMISO
+        url (str): MeldungList.do URL, overridable for a local stub server
+        auth (tuple): (username, password), loaded from AUTH_FILE_PATH if omitted
+        max_workers (int): Maximum number of requests in flight
+        page_size (int): Rows requested per page
+
+    Yields:
+        dict: One row dict per report row
+
+    Raises:
+        requests.RequestException: If a page cannot be fetched, so a refresh
+            never continues with a truncated report list
+        RuntimeError: If the server ignores BMI_PAGE_FIELD or the list has
+            more than BMI_MAX_PAGES pages, for the same reason
+    """
+    auth = auth or load_bmi_auth()
+    if not auth:
+        return
+
+    seen_first_ids = set()
+    with create_bmi_session(auth, pool_size=max_workers) as session, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+        next_page = 1
+        last_page = None
+        while True:
+            while len(pending) < max_workers and last_page is None and next_page <= BMI_MAX_PAGES:
+                future = executor.submit(fetch_bmi_page, session, url, termin, sachgebiet, next_page, page_size)
+                pending[future] = next_page
+                next_page += 1
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                page = pending.pop(future)
+                rows = future.result()
+                if len(rows) < page_size:
+                    last_page = page if last_page is None else min(last_page, page)
+                if last_page is not None and page > last_page:
                     continue
+                # A server that ignores the page field answers every page with page 1
+                if rows and rows[0]['id2'] in seen_first_ids:
+                    raise RuntimeError(f"Page {page} repeats an earlier page, the server ignores {BMI_PAGE_FIELD}")
+                if rows:
+                    seen_first_ids.add(rows[0]['id2'])
+                yield from rows
+
+        if next_page > BMI_MAX_PAGES and last_page is None:
+            raise RuntimeError(f"The report list has more than {BMI_MAX_PAGES} pages, raise BMI_MAX_PAGES")
+
+
+# Function to parse HTML response
+def parse_bmi_html(html_content, encoding='utf-8', progress=None):
+    """
+    Parse a complete HTML response or a stream of HTML chunks into a dict keyed by id2.
+
+    progress is an optional callable that gets the number of rows parsed so
+    far every PARSE_PROGRESS_ROWS rows, while the stream is still arriving.
+
+    Raises:
+        requests.RequestException: If the stream breaks off, so the rows read
+            so far are never taken for the complete report list
+    """
+    bmi_dict = {}
+    if isinstance(html_content, (str, bytes)):
+        html_content = [html_content]
+    try:
+        for row in iter_bmi_rows(html_content, encoding=encoding):
+            # Store in dictionary with id2 as key
+            bmi_dict[row['id2']] = row
+            if progress and len(bmi_dict) % PARSE_PROGRESS_ROWS == 0:
+                progress(len(bmi_dict))
+    except requests.RequestException:
+        raise
     except Exception as e:
         print(f"Error parsing HTML: {e}")
 
     return bmi_dict
 
-def get_bmi_data_dict(termin, statistics):
-
-
+def get_bmi_data_dict(termin, statistics, paged=False, progress=None):
+    """Fetch and parse the report list of a termin, progress gets the running row count as in parse_bmi_html"""
     sachgebiet= '14' if statistics=='wpi' else '17'
+    if paged:
+        print(f"Fetching paged data from BMI website for termin {termin}...")
+        try:
+            bmi_dict = {}
+            for row in iter_bmi_pages(termin, sachgebiet=sachgebiet):
+                bmi_dict[row['id2']] = row
+                if progress and len(bmi_dict) % PARSE_PROGRESS_ROWS == 0:
+                    progress(len(bmi_dict))
+        except Exception as e:
+            print(f"Error fetching BMI pages: {e}")
+            return
+        if not bmi_dict:
+            print("No data found in BMI pages.")
+            return
+        print(f"Found {len(bmi_dict)} entries in BMI data.")
+        return bmi_dict
+
     print(f"Fetching data from BMI website for termin {termin}...")
-    html_content = fetch_bmi_data(termin, sachgebiet=sachgebiet)
-    if not html_content:
+    html_chunks, encoding = fetch_bmi_stream(termin, sachgebiet=sachgebiet)
+    if not html_chunks:
         print("Failed to fetch data from BMI website.")
         # For testing purposes, try loading from a file
         try:
             with open('response.html', 'r', encoding='utf-8') as file:
-                html_content = file.read()
+                html_chunks, encoding = [file.read()], 'utf-8'
                 print("Loaded HTML from response.html for testing.")
         except Exception as e:
             print(f"Could not load response.html: {e}")
             return
 
-    # Parse HTML response
+    # Parse HTML response while it is still arriving
     print("Parsing HTML response...")
-    bmi_dict = parse_bmi_html(html_content)
+    try:
+        bmi_dict = parse_bmi_html(html_chunks, encoding=encoding, progress=progress)
+    except requests.RequestException as e:
+        # A refresh never stores a truncated list
+        print(f"Error reading BMI response: {e}")
+        return
     if not bmi_dict:
         print("No data found in HTML response.")
         return
     print(f"Found {len(bmi_dict)} entries in BMI data.")
-    return bmi_dict
\ No newline at end of file
+    if len(bmi_dict) >= BMI_LIST_SIZE:
+        print(f"Warning: the list is capped at {BMI_LIST_SIZE} rows, use paged mode to fetch all reports.")
+    return bmi_dict
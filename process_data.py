@@ -6,9 +6,13 @@ from bs4 import BeautifulSoup
 import urllib3
 import os
 import datetime
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import process_bmi
 import utils
 import db_utils
+import importe_mirror
 from utils import load_yaml_config
 # Disable SSL certificate verification warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -19,7 +23,74 @@ DB_CFG_FILE = "db_cfg.yml"
 
 
 
-def process_data(termin, statistics):
+def load_importe(sql_conn, statistics, dateien=None):
+    """Load the importe and abgewiesen indexes from SQL Server, restricted to dateien if given"""
+    importe_query = db_utils.importe_statement(statistics, IMPORT_CUT_DATE)
+
+    if dateien is not None:
+        importe_dict = db_utils.load_sql_server_index_for_keys(sql_conn, importe_query, key='datei_id', keys=dateien)
+    else:
+        importe_dict = db_utils.load_sql_index(sql_conn, importe_query, key='datei_id')
+    print(f"Loaded {len(importe_dict)} records from wpi-importe.")
+
+    importe_abgewiesen_query = db_utils.importe_abgewiesen_statement(statistics, IMPORT_CUT_DATE)
+
+    if dateien is not None:
+        importe_abgewiesen_dict = db_utils.load_sql_server_index_for_keys(sql_conn, importe_abgewiesen_query,
+                                                                          key='import_datei_id', keys=dateien)
+    else:
+        importe_abgewiesen_dict = db_utils.load_sql_index(sql_conn, importe_abgewiesen_query, key='import_datei_id')
+    print(f"Loaded {len(importe_abgewiesen_dict)} records from wpi-importe-abgewiesen-flat.")
+
+    return importe_dict, importe_abgewiesen_dict
+
+
+def sync_importe_mirror(db_config, statistics, full=False):
+    """Bring the local importe mirror up to date, False if SQL Server is unreachable"""
+    print("Connecting to MS-SQL Server...")
+    sql_conn = db_utils.connect_to_sql_server(db_config, stage='PROD')
+    if not sql_conn:
+        print("Failed to connect to MS-SQL Server, matching against the existing mirror.")
+        return False
+    try:
+        return importe_mirror.sync_mirror(sql_conn, statistics, IMPORT_CUT_DATE, full=full)
+    finally:
+        sql_conn.close()
+
+
+def load_mirrored_importe(db_config, statistics, dateien=None, sync=True):
+    """
+    Load the importe and abgewiesen indexes from the local mirror after an optional delta sync.
+
+    Returns None if a mirror has never been synced, matching against it
+    would mark every file as missing.
+    """
+    if sync:
+        sync_importe_mirror(db_config, statistics)
+
+    importe_dict = importe_mirror.load_mirror_index(statistics, 'importe', keys=dateien)
+    importe_abgewiesen_dict = importe_mirror.load_mirror_index(statistics, 'abgewiesen', keys=dateien)
+    if importe_dict is None or importe_abgewiesen_dict is None:
+        print("No synced importe mirror to match against.")
+        return None
+    print(f"Loaded {len(importe_dict)} records from the importe mirror.")
+    print(f"Loaded {len(importe_abgewiesen_dict)} records from the importe-abgewiesen mirror.")
+    return importe_dict, importe_abgewiesen_dict
+
+
+def report_progress(progress, stage, rows=None):
+    if progress:
+        progress(stage, rows)
+
+
+def build_bmi_dict(termin, statistics, paged=False, targeted=False, mirror=False, sync_mirror=True, progress=None):
+    """
+    Fetch, parse and match the BMI data of a termin, returns the merged records keyed by id2.
+
+    progress is an optional callable that gets (stage, rows): 'fetch' when
+    the request starts, 'parse' with the running row count while the report
+    list streams in and is parsed, and 'match' when the importe lookup starts.
+    """
     print(f"Starting BMI data processor for termin {termin}...")
 
 
@@ -31,30 +102,32 @@ def process_data(termin, statistics):
         return
 
     # Get dta from BMI
-    bmi_dict=process_bmi.get_bmi_data_dict(termin, statistics)
-
-    # Connect to MS-SQL Server
-    print("Connecting to MS-SQL Server...")
-    sql_conn = db_utils.connect_to_sql_server(db_config, stage='PROD')
-    if not sql_conn:
-        print("Failed to connect to MS-SQL Server.")
+    report_progress(progress, 'fetch')
+    bmi_dict=process_bmi.get_bmi_data_dict(termin, statistics, paged=paged,
+                                           progress=lambda rows: report_progress(progress, 'parse', rows))
+    if not bmi_dict:
         return
 
+    report_progress(progress, 'match', len(bmi_dict))
 
+    # In targeted mode only the rows for the termin's files are looked up
+    dateien = [value['datei'] for value in bmi_dict.values()] if targeted else None
 
-    importe_query=db_utils.emiso_importe_statement(IMPORT_CUT_DATE) if statistics=='emiso' else db_utils.wpi_importe_statement(IMPORT_CUT_DATE)
+    if mirror:
+        mirrored = load_mirrored_importe(db_config, statistics, dateien, sync=sync_mirror)
+        if mirrored is None:
+            return
+        importe_dict, importe_abgewiesen_dict = mirrored
+    else:
+        # Connect to MS-SQL Server
+        print("Connecting to MS-SQL Server...")
+        sql_conn = db_utils.connect_to_sql_server(db_config, stage='PROD')
+        if not sql_conn:
+            print("Failed to connect to MS-SQL Server.")
+            return
 
-    importe_data = db_utils.load_sql_data(sql_conn, importe_query)
-    importe_dict = {record['datei_id']: record for record in importe_data}
-    print(f"Loaded {len(importe_dict)} records from wpi-importe.")
-
-    importe_abgewiesen_query = db_utils.emiso_importe_abgewiesen_statement(IMPORT_CUT_DATE) if statistics=='emiso' else db_utils.wpi_importe_abgewiesen_statement(IMPORT_CUT_DATE)
-
-    importe_abgewiesen_data = db_utils.load_sql_data(sql_conn, importe_abgewiesen_query)
-    importe_abgewiesen_dict = {record['import_datei_id']: record for record in importe_abgewiesen_data}
-    print(f"Loaded {len(importe_abgewiesen_dict)} records from wpi-importe-abgewiesen-flat.")
-
-    sql_conn.close()
+        importe_dict, importe_abgewiesen_dict = load_importe(sql_conn, statistics, dateien)
+        sql_conn.close()
 
     print("Matching data between sources...")
     match_count_import = 0
@@ -70,7 +143,7 @@ def process_data(termin, statistics):
 
             # Add all attributes from wpi_importe_dict
             import_record = importe_dict[dateiname_bmi]
-            for attr_key, attr_value in import_record.items():
+            for attr_key, attr_value in zip(import_record._fields, import_record):
                 # Convert any non-string values to strings
                 if attr_value is not None and not isinstance(attr_value, str):
                     attr_value = str(attr_value)
@@ -83,7 +156,7 @@ def process_data(termin, statistics):
 
             # Add all attributes from wpi_importe_abgewiesen_flat_dict
             rejected_record = importe_abgewiesen_dict[dateiname_bmi]
-            for attr_key, attr_value in rejected_record.items():
+            for attr_key, attr_value in zip(rejected_record._fields, rejected_record):
                 # Convert any non-string values to strings
                 if attr_value is not None and not isinstance(attr_value, str):
                     attr_value = str(attr_value)
@@ -92,20 +165,151 @@ def process_data(termin, statistics):
     print(f"Found {match_count_import} matches in importe.")
     print(f"Found {match_count_rejected} matches in importe-abgewiesen-flat.")
 
+    return bmi_dict
+
+
+def store_bmi_dict(bmi_dict, termin, statistics, incremental=False, started_at=None, mirror=False, paged=False):
+    """Write the merged records of a termin to the SQLite database, falsy on error"""
+    # The catalog records the mirror's watermark, without a mirror the writer falls back to the newest import
+    source_watermark = importe_mirror.get_mirror_watermark(statistics) if mirror else None
+
     # Create or update SQLite database
     print("Creating/updating SQLite database...")
-    db_utils.insert_into_bmi_table(data_dict=bmi_dict, termin=termin, db_path='bmi_data.db', statistics=statistics)
+    if incremental:
+        # An unpaged list of BMI_LIST_SIZE rows may be capped, the rows it misses must not be deleted
+        complete = paged or len(bmi_dict) < process_bmi.BMI_LIST_SIZE
+        return db_utils.sync_bmi_table(data_dict=bmi_dict, termin=termin, db_path='bmi_data.db', statistics=statistics,
+                                       started_at=started_at, source_watermark=source_watermark, complete=complete)
+    return db_utils.insert_into_bmi_table(data_dict=bmi_dict, termin=termin, db_path='bmi_data.db', statistics=statistics,
+                                          started_at=started_at, source_watermark=source_watermark)
+
+
+def process_data(termin, statistics, incremental=False, paged=False, targeted=False, mirror=False, progress=None):
+    """Import one termin, returns the number of BMI records or None if nothing was imported"""
+    started_at = time.time()
+    bmi_dict = build_bmi_dict(termin, statistics, paged=paged, targeted=targeted, mirror=mirror, progress=progress)
+    if not bmi_dict:
+        return
+    report_progress(progress, 'write', len(bmi_dict))
+    if not store_bmi_dict(bmi_dict, termin, statistics, incremental=incremental, started_at=started_at,
+                          mirror=mirror, paged=paged):
+        return
     print(f"Process completed successfully lala for termin {termin}.")
+    return len(bmi_dict)
+
 
-def main():
-    # Example usage
-    current_month = "202504"
-    process_data(current_month, statistics='emiso')
+def termin_range(start, end):
+    """List the termins (YYYYMM) from start to end, both included"""
+    year, month = int(start[:4]), int(start[4:])
+    termins = []
+    while f"{year:04d}{month:02d}" <= end:
+        termins.append(f"{year:04d}{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return termins
 
 
+def build_job(termin, statistics, paged, targeted, mirror):
+    """Process pool job: fetch, parse and match one (termin, statistics) pair without writing"""
+    start = time.perf_counter()
+    bmi_dict = build_bmi_dict(termin, statistics, paged=paged, targeted=targeted, mirror=mirror, sync_mirror=False)
+    return bmi_dict, time.perf_counter() - start
+
+
+def backfill(termins, statistics_list, workers=2, incremental=False, paged=False, targeted=False, mirror=False):
+    """
+    Re-import several termins for several statistics types in parallel.
+
+    Fetching, parsing and matching run in a process pool, one job per
+    (termin, statistics) pair. The jobs return their merged records and
+    this process writes them one after another, so it is the only writer of
+    bmi_data.db and the jobs never wait on its lock.
+
+    Args:
+        termins (list): Termins (YYYYMM) to import
+        statistics_list (list): Statistics types, 'wpi' and/or 'emiso'
+        workers (int): Number of worker processes
+        incremental (bool): Write with the incremental diff instead of a full upsert
+        paged (bool): Fetch BMI data page by page
+        targeted (bool): Look up only the termin's files in the importe sources
+        mirror (bool): Match against the local importe mirror
+
+    Returns:
+        list: (termin, statistics, rows, job seconds, write seconds) per finished job
+    """
+    if mirror:
+        # Sync once up front, the jobs only read the mirror
+        db_config = load_yaml_config(DB_CFG_FILE)
+        if db_config:
+            for statistics in statistics_list:
+                sync_importe_mirror(db_config, statistics)
+
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(build_job, termin, statistics, paged, targeted, mirror): (termin, statistics)
+            for statistics in statistics_list for termin in termins
+        }
+        for future in as_completed(futures):
+            termin, statistics = futures[future]
+            try:
+                bmi_dict, job_seconds = future.result()
+            except Exception as e:
+                print(f"[{statistics} {termin}] failed: {e}")
+                continue
+            if not bmi_dict:
+                print(f"[{statistics} {termin}] no data after {job_seconds:.1f}s")
+                continue
+
+            write_start = time.perf_counter()
+            if not store_bmi_dict(bmi_dict, termin, statistics, incremental=incremental,
+                                  started_at=time.time() - job_seconds, mirror=mirror, paged=paged):
+                print(f"[{statistics} {termin}] failed: the rows could not be written")
+                continue
+            write_seconds = time.perf_counter() - write_start
+            results.append((termin, statistics, len(bmi_dict), job_seconds, write_seconds))
+            print(f"[{statistics} {termin}] {len(bmi_dict)} rows, fetch/parse/match {job_seconds:.1f}s, "
+                  f"write {write_seconds:.2f}s")
+
+    elapsed = time.perf_counter() - start
+    total_rows = sum(result[2] for result in results)
+    print(f"Backfill finished: {len(results)}/{len(futures)} jobs, {total_rows} rows in {elapsed:.1f}s "
+          f"({total_rows / max(elapsed, 1e-9):.0f} rows/s, {workers} workers)")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import BMI data for one termin or a range of termins.")
+    parser.add_argument('start', nargs='?', default='202504', help="First termin (YYYYMM)")
+    parser.add_argument('end', nargs='?', help="Last termin (YYYYMM), defaults to the first one")
+    parser.add_argument('--statistics', nargs='+', choices=['wpi', 'emiso'], default=['emiso'])
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument('--incremental', action='store_true', help="Only write changed rows")
+    parser.add_argument('--paged', action='store_true', help="Fetch BMI data page by page")
+    parser.add_argument('--targeted', action='store_true', help="Only look up the termin's files")
+    parser.add_argument('--mirror', action='store_true', help="Match against the local importe mirror")
+    parser.add_argument('--migrate-to-entries', action='store_true',
+                        help="Move all termin tables into the single bmi_entries table and exit")
+    args = parser.parse_args(argv)
+
+    if args.migrate_to_entries:
+        db_utils.migrate_to_entries('bmi_data.db')
+        return
 
+    for termin in filter(None, [args.start, args.end]):
+        if not termin.isdigit() or len(termin) != 6 or not 1 <= int(termin[4:]) <= 12:
+            parser.error(f"Invalid termin format {termin}. Must be YYYYMM (e.g., 202405)")
+    if args.end and args.end < args.start:
+        parser.error(f"The last termin {args.end} is before the first termin {args.start}")
 
+    termins = termin_range(args.start, args.end or args.start)
+    if len(termins) * len(args.statistics) == 1:
+        process_data(termins[0], args.statistics[0], incremental=args.incremental, paged=args.paged,
+                     targeted=args.targeted, mirror=args.mirror)
+    else:
+        backfill(termins, args.statistics, workers=args.workers, incremental=args.incremental,
+                 paged=args.paged, targeted=args.targeted, mirror=args.mirror)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
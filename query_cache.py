@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+
+RESULT_CACHE_SECONDS = 10  # How long a result is served again; its key holds the data version, so writes never hit it
+RESULT_CACHE_SIZE = 256  # Number of results kept, the least recently used is dropped first
+
+# Finished results keyed by query, each with the monotonic time it expires at
+results = OrderedDict()
+# Queries being computed right now, each with the Flight its duplicates wait on
+in_flight = {}
+cache_lock = threading.Lock()
+
+
+class Flight:
+    """One running computation that requests for the same key wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def get_or_compute(key, compute):
+    """
+    Get the result of a query, computing it at most once for all concurrent callers.
+
+    A result computed in the last RESULT_CACHE_SECONDS is returned as is. If
+    the same key is being computed by another request, this one waits for it
+    and shares its result or exception instead of running the query again.
+    The key has to contain everything the result depends on, including the
+    data version of the termin.
+
+    Args:
+        key (tuple): Hashable description of the query
+        compute: Callable without arguments that runs the query
+
+    Returns:
+        The result of compute, shared between callers and not to be modified
+    """
+    with cache_lock:
+        cached = results.get(key)
+        if cached is not None and cached[1] > time.monotonic():
+            results.move_to_end(key)
+            return cached[0]
+        flight = in_flight.get(key)
+        leader = flight is None
+        if leader:
+            flight = in_flight[key] = Flight()
+
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        flight.result = compute()
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with cache_lock:
+            del in_flight[key]
+            if flight.error is None:
+                results[key] = (flight.result, time.monotonic() + RESULT_CACHE_SECONDS)
+                results.move_to_end(key)
+                while len(results) > RESULT_CACHE_SIZE:
+                    results.popitem(last=False)
+        flight.done.set()
+    return flight.result
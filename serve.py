@@ -0,0 +1,58 @@
+import argparse
+import signal
+import sys
+import threading
+import _thread
+from waitress import serve
+import jobs
+from app import create_app
+
+SERVE_THREADS = 8  # Requests handled at the same time, as many as db_utils keeps pooled SQLite connections
+SERVE_PORT = 5000
+DRAIN_SECONDS = 10  # How long /healthz reports 503 before the listener closes, a few proxy health check intervals
+
+
+def drain(seconds):
+    """Signal handler factory: report shutting down on /healthz, then stop the server after seconds"""
+    def stop(signum, frame):
+        if not jobs.get_status()['accepting']:
+            # A second signal stops right away; waitress finishes the requests it is handling
+            sys.exit(0)
+        jobs.stop_accepting()
+        print(f"Shutting down in {seconds:g}s, /healthz reports 503 until then")
+        # The handler runs on waitress's main loop, so the wait happens elsewhere
+        timer = threading.Timer(seconds, _thread.interrupt_main)
+        timer.daemon = True
+        timer.start()
+    return stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the WPI Monitor dashboard with waitress.")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on, the reverse proxy connects here")
+    parser.add_argument('--port', type=int, default=SERVE_PORT)
+    parser.add_argument('--threads', type=int, default=SERVE_THREADS)
+    parser.add_argument('--drain-seconds', type=float, default=DRAIN_SECONDS,
+                        help="Seconds to keep serving after SIGTERM while /healthz reports 503")
+    parser.add_argument('--shutdown-timeout', type=float,
+                        help="Seconds to wait for running refresh jobs on shutdown, waits until they finish by default")
+    args = parser.parse_args()
+
+    # Load and prepare the app before the first connection is accepted
+    application = create_app()
+
+    stop = drain(args.drain_seconds)
+    signal.signal(signal.SIGTERM, stop)
+    if hasattr(signal, 'SIGBREAK'):  # Ctrl+Break and service managers on Windows
+        signal.signal(signal.SIGBREAK, stop)
+
+    try:
+        serve(application, host=args.host, port=args.port, threads=args.threads, ident='wpimonitor')
+    finally:
+        print("Shutting down, waiting for refresh jobs to finish...")
+        if not jobs.shutdown(args.shutdown_timeout):
+            print("Refresh jobs still running, they will be marked failed on the next start")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import threading
+import time
+import db_utils
+
+DB_PATH = 'bmi_data.db'
+# How long the cached settings are served before the version stamp is checked for changes by other processes
+SETTINGS_RECHECK_SECONDS = 1.0
+
+# Default settings using values from process_data_new.py
+DEFAULT_SETTINGS = {
+    'import_cut_date': '20250101',  # Default to January 1, 2025
+    'auth_file_path': 'auth.yml',  # Default authentication file
+    'statistics': 'wpi'  # Default statistics type
+}
+
+# Settings of this process, loaded on first use
+cached_settings = None
+cached_version = None
+checked_at = 0.0
+settings_lock = threading.Lock()
+
+
+def initialize_settings():
+    """Create the settings and version tables if they don't exist and add missing default settings"""
+    with db_utils.sqlite_connection(DB_PATH) as conn:
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        ''')
+        # Bumped by every update, so other processes know their cached settings are stale
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS settings_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+        ''')
+        conn.execute("INSERT OR IGNORE INTO settings_version (id, version) VALUES (1, 0)")
+        conn.executemany("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", DEFAULT_SETTINGS.items())
+
+
+def load_settings(conn):
+    """Read all settings, falling back to the defaults for missing or empty values"""
+    settings = {row[0]: row[1] for row in conn.execute("SELECT key, value FROM settings")}
+
+    # Ensure all settings exist with non-empty values
+    for key, default_value in DEFAULT_SETTINGS.items():
+        if key not in settings or not settings[key]:
+            settings[key] = default_value
+    return settings
+
+
+def get_settings():
+    """
+    Get all settings from memory.
+
+    The settings are loaded on first use, creating the tables if needed. After
+    that the database is only read once every SETTINGS_RECHECK_SECONDS to
+    compare the version stamp, and the settings are re-read only when another
+    process changed them.
+    """
+    global cached_settings, cached_version, checked_at
+    with settings_lock:
+        if cached_settings is None or time.monotonic() - checked_at > SETTINGS_RECHECK_SECONDS:
+            if cached_settings is None:
+                initialize_settings()
+            with db_utils.sqlite_connection(DB_PATH) as conn:
+                version = conn.execute("SELECT version FROM settings_version WHERE id = 1").fetchone()[0]
+                if version != cached_version:
+                    cached_settings = load_settings(conn)
+                    cached_version = version
+            checked_at = time.monotonic()
+        return dict(cached_settings)
+
+
+def update_settings(new_settings):
+    """Write settings to the database and the cache, and bump the version stamp for other processes"""
+    global cached_settings, cached_version, checked_at
+    with settings_lock:
+        if cached_settings is None:
+            initialize_settings()
+        with db_utils.sqlite_connection(DB_PATH) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany("UPDATE settings SET value = ? WHERE key = ?",
+                             [(value, key) for key, value in new_settings.items()])
+            conn.execute("UPDATE settings_version SET version = version + 1 WHERE id = 1")
+            cached_settings = load_settings(conn)
+            cached_version = conn.execute("SELECT version FROM settings_version WHERE id = 1").fetchone()[0]
+        checked_at = time.monotonic()
+
+    return True
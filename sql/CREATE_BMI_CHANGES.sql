@@ -0,0 +1,3 @@
+CREATE TABLE IF NOT EXISTS bmi_row_hashes (statistics TEXT, termin TEXT, id2 TEXT, row_hash TEXT, PRIMARY KEY (statistics, termin, id2)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS bmi_changes (statistics TEXT, termin TEXT, id2 TEXT, datei TEXT, change TEXT, changed_at TEXT);
+CREATE INDEX IF NOT EXISTS bmi_changes_termin ON bmi_changes (statistics, termin, changed_at);
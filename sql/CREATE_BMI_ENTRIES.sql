@@ -0,0 +1 @@
+CREATE TABLE IF NOT EXISTS bmi_entries (statistics TEXT, abweisen_check_befund_check_beschreibung_extern TEXT, abweisen_check_befund_check_beschreibung_kurz TEXT, abweisen_check_befund_check_details TEXT, abweisen_check_befund_check_gruppe TEXT, abweisen_check_befund_check_name TEXT, anwendungs_id TEXT, befoerderungs_datum TEXT, blz TEXT, comment TEXT, datei TEXT, datei_id TEXT, dateiname TEXT, empfangszeit TEXT, erstellt TEXT, externe_referenz TEXT, id1 TEXT, id2 TEXT, import_anwendungs_id TEXT, import_befoerderungs_datum TEXT, import_blz TEXT, import_datei_id TEXT, import_dateiname TEXT, import_empfangszeit TEXT, import_externe_referenz TEXT, import_found BOOLEAN, import_melder_id TEXT, import_melder_id_art TEXT, import_meldetermin TEXT, institutstyp TEXT, last_updated TEXT, melder_id TEXT, melder_id_art TEXT, meldetermin TEXT, ok BOOLEAN, rejected_import_found BOOLEAN, termin TEXT, typ TEXT, PRIMARY KEY (statistics, termin, id2));
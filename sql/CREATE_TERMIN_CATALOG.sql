@@ -0,0 +1 @@
+CREATE TABLE IF NOT EXISTS termin_catalog (statistics TEXT, termin TEXT, row_count INTEGER, last_refresh TEXT, refresh_duration REAL, source_watermark TEXT, data_version INTEGER NOT NULL DEFAULT 0, last_modified REAL, PRIMARY KEY (statistics, termin)) WITHOUT ROWID;
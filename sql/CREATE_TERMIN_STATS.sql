@@ -0,0 +1 @@
+CREATE TABLE IF NOT EXISTS termin_stats (statistics TEXT, termin TEXT, typ TEXT, institutstyp TEXT, total INTEGER, missing INTEGER, rejected INTEGER, ok INTEGER, PRIMARY KEY (statistics, termin, typ, institutstyp)) WITHOUT ROWID;
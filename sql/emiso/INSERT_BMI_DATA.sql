@@ -40,7 +40,7 @@ INSERT INTO BMI_EMISO{termin} (
 VALUES (
     ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
 )
-ON CONFLICT DO UPDATE SET
+ON CONFLICT(id2) DO UPDATE SET
     abweisen_check_befund_check_beschreibung_extern = excluded.abweisen_check_befund_check_beschreibung_extern,
     abweisen_check_befund_check_beschreibung_kurz = excluded.abweisen_check_befund_check_beschreibung_kurz,
     abweisen_check_befund_check_details = excluded.abweisen_check_befund_check_details,
@@ -14,6 +14,9 @@ document.addEventListener('DOMContentLoaded', function() {
     const columnFilters = document.querySelectorAll('.column-filter');
     const sortableHeaders = document.querySelectorAll('th.sortable');
     const rejectedFilesBtn = document.getElementById('rejectedFilesBtn');
+    const markOkBtn = document.getElementById('markOkBtn');
+    const selectedCount = document.getElementById('selectedCount');
+    const selectAll = document.getElementById('selectAll');
 
     // Statistics selection elements
     const wpiRadio = document.getElementById('wpiRadio');
@@ -42,6 +45,18 @@ document.addEventListener('DOMContentLoaded', function() {
     let sortOrder = 'asc';
     let filters = {};
     let currentEntry = null;
+    // Cursors of the first and last row of the current page, used for previous/next
+    let prevCursor = null;
+    let nextCursor = null;
+    let pageCursor = null;
+    // id2s of the rows checked on the current page
+    let selectedRows = new Set();
+    // Pending column filter reload and the request of the page being loaded
+    let filterTimer = null;
+    let loadController = null;
+    const FILTER_DEBOUNCE_MS = 300;
+    // Columns the table shows; the details dialog loads the full entry
+    const TABLE_COLUMNS = ['id2', 'datei', 'erstellt', 'melder_id', 'typ', 'import_found', 'rejected_import_found', 'ok'];
 
     // Initialize Advanced Settings
     const importCutDate = document.getElementById('importCutDate');
@@ -184,7 +199,10 @@ document.addEventListener('DOMContentLoaded', function() {
                 delete filters[field];
             }
             currentPage = 1;
-            loadData();
+
+            // Reload once typing pauses instead of on every keystroke
+            clearTimeout(filterTimer);
+            filterTimer = setTimeout(loadData, FILTER_DEBOUNCE_MS);
         });
     });
 
@@ -258,8 +276,15 @@ document.addEventListener('DOMContentLoaded', function() {
             })
             .then(response => response.json())
             .then(data => {
+                if (!data.success) {
+                    throw new Error(data.error || 'Unknown error');
+                }
+                // The update runs as a background job, poll it until it is done
+                return waitForJob(data.job_id);
+            })
+            .then(job => {
                 loadingModal.hide();
-                if (data.success) {
+                if (job.status === 'finished') {
                     alert('Data updated successfully!');
                     // If this was a new termin, refresh the termin list
                     if (customTermin) {
@@ -268,16 +293,41 @@ document.addEventListener('DOMContentLoaded', function() {
                         loadData();
                     }
                 } else {
-                    alert('Error updating data: ' + (data.error || 'Unknown error'));
+                    alert('Error updating data: ' + (job.error || 'Unknown error'));
                 }
             })
             .catch(error => {
                 loadingModal.hide();
-                alert('Error: ' + error);
+                alert('Error: ' + error.message);
             });
         }
     });
 
+    // Poll an update job until it has finished or failed
+    function waitForJob(jobId) {
+        const loadingStatus = document.getElementById('loadingStatus');
+
+        return new Promise((resolve, reject) => {
+            function poll() {
+                fetch(`/api/jobs/${jobId}`)
+                    .then(response => response.json())
+                    .then(job => {
+                        if (job.status === 'finished' || job.status === 'failed') {
+                            loadingStatus.textContent = 'Please wait, this may take a moment.';
+                            resolve(job);
+                            return;
+                        }
+                        if (job.stage) {
+                            loadingStatus.textContent = `Stage: ${job.stage}, ${job.rows || 0} rows, ${job.elapsed_seconds || 0}s elapsed`;
+                        }
+                        setTimeout(poll, 1000);
+                    })
+                    .catch(reject);
+            }
+            poll();
+        });
+    }
+
     // Save entry changes
     saveEntryBtn.addEventListener('click', function() {
         if (currentEntry) {
@@ -311,6 +361,57 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
+    // Update the selection count and the Mark OK button
+    function updateSelection() {
+        selectedCount.textContent = selectedRows.size;
+        markOkBtn.disabled = selectedRows.size === 0;
+        const checkboxes = tableBody.querySelectorAll('.row-select');
+        selectAll.checked = checkboxes.length > 0 && selectedRows.size === checkboxes.length;
+    }
+
+    // Select or unselect all rows of the page
+    selectAll.addEventListener('change', function() {
+        tableBody.querySelectorAll('.row-select').forEach(checkbox => {
+            checkbox.checked = selectAll.checked;
+            if (selectAll.checked) {
+                selectedRows.add(checkbox.dataset.id2);
+            } else {
+                selectedRows.delete(checkbox.dataset.id2);
+            }
+        });
+        updateSelection();
+    });
+
+    // Mark all selected rows OK in one request
+    markOkBtn.addEventListener('click', function() {
+        const termin = terminSelect.value;
+        if (!termin || selectedRows.size === 0) return;
+
+        markOkBtn.disabled = true;
+        fetch(`/api/entries/${termin}?statistics=${currentStatistics}`, {
+            method: 'PATCH',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                entries: Array.from(selectedRows, id2 => ({id2: id2, ok: true}))
+            })
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                loadData();
+            } else {
+                alert('Error saving changes: ' + data.error);
+                updateSelection();
+            }
+        })
+        .catch(error => {
+            alert('Error: ' + error);
+            updateSelection();
+        });
+    });
+
     // Function to switch statistics type
     function switchStatistics(statistics) {
         if (currentStatistics === statistics) {
@@ -365,13 +466,23 @@ document.addEventListener('DOMContentLoaded', function() {
         const termin = terminSelect.value;
         if (!termin) return;
 
+        // Only the latest request may render, an older one still running is cancelled
+        clearTimeout(filterTimer);
+        if (loadController) {
+            loadController.abort();
+        }
+        const controller = new AbortController();
+        loadController = controller;
+
         // Build query parameters
         const params = new URLSearchParams({
             statistics: currentStatistics,
             page: currentPage,
             page_size: pageSize,
             sort_by: sortBy,
-            sort_order: sortOrder
+            sort_order: sortOrder,
+            columns: TABLE_COLUMNS.join(','),
+            shape: 'columnar'
         });
 
         // Add filters
@@ -379,39 +490,50 @@ document.addEventListener('DOMContentLoaded', function() {
             params.append(key, value);
         }
 
-        // Fetch data
-        fetch(`/api/data/${termin}?${params}`)
+        // Seek from the current page instead of counting rows up to the page number
+        if (pageCursor) {
+            params.append(pageCursor.direction, pageCursor.cursor);
+            pageCursor = null;
+        }
+
+        // Fetch the page and the termin statistics in one request
+        fetch(`/api/view/${termin}?${params}`, { signal: controller.signal })
             .then(response => response.json())
             .then(data => {
-                renderTable(data.data);
+                prevCursor = data.prev_cursor;
+                nextCursor = data.next_cursor;
+                renderTable(rowObjects(data));
                 renderPagination(data.total);
                 totalRecords.textContent = data.total;
-
-                // Also load statistics
-                fetchStatistics(termin);
+                renderStatistics(data.statistics);
             })
             .catch(error => {
+                if (error.name === 'AbortError') return;
                 console.error('Error loading data:', error);
-                tableBody.innerHTML = `<tr><td colspan="6" class="text-center">Error loading data: ${error}</td></tr>`;
+                tableBody.innerHTML = `<tr><td colspan="7" class="text-center">Error loading data: ${error}</td></tr>`;
+            })
+            .finally(() => {
+                if (loadController === controller) {
+                    loadController = null;
+                }
             });
     }
 
-    // Function to fetch statistics
-    function fetchStatistics(termin) {
-        fetch(`/api/statistics/${termin}?statistics=${currentStatistics}`)
-            .then(response => response.json())
-            .then(data => {
-                missingCount.textContent = data.missing_count;
-                missingPercentage.textContent = data.missing_percentage + '%';
-            })
-            .catch(error => {
-                console.error('Error loading statistics:', error);
-            });
+    // Turn a columnar page ({columns, rows}) into one object per row
+    function rowObjects(data) {
+        return data.rows.map(values => Object.fromEntries(data.columns.map((column, i) => [column, values[i]])));
+    }
+
+    // Render the termin statistics
+    function renderStatistics(data) {
+        missingCount.textContent = data.missing_count;
+        missingPercentage.textContent = data.missing_percentage + '%';
     }
 
     // Render table function
     function renderTable(data) {
         tableBody.innerHTML = '';
+        selectedRows.clear();
 
         data.forEach(item => {
             const row = document.createElement('tr');
@@ -425,6 +547,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
             // Add columns
             row.innerHTML = `
+                <td><input type="checkbox" class="form-check-input row-select" data-id2="${escapeHtml(item.id2)}"></td>
                 <td>${escapeHtml(item.datei || '')}</td>
                 <td>${escapeHtml(item.erstellt || '')}</td>
                 <td>${escapeHtml(item.melder_id || '')}</td>
@@ -438,8 +561,23 @@ document.addEventListener('DOMContentLoaded', function() {
                 openEntryDetails(item.id2);
             });
 
+            // Selecting a row does not open it
+            const checkbox = row.querySelector('.row-select');
+            checkbox.addEventListener('click', function(event) {
+                event.stopPropagation();
+            });
+            checkbox.addEventListener('change', function() {
+                if (checkbox.checked) {
+                    selectedRows.add(item.id2);
+                } else {
+                    selectedRows.delete(item.id2);
+                }
+                updateSelection();
+            });
+
             tableBody.appendChild(row);
         });
+        updateSelection();
     }
 
     // Helper function to display appropriate status icon
@@ -466,6 +604,9 @@ document.addEventListener('DOMContentLoaded', function() {
             e.preventDefault();
             if (currentPage > 1) {
                 currentPage--;
+                if (prevCursor) {
+                    pageCursor = {direction: 'before', cursor: prevCursor};
+                }
                 loadData();
             }
         });
@@ -499,6 +640,9 @@ document.addEventListener('DOMContentLoaded', function() {
             e.preventDefault();
             if (currentPage < totalPages) {
                 currentPage++;
+                if (nextCursor) {
+                    pageCursor = {direction: 'after', cursor: nextCursor};
+                }
                 loadData();
             }
         });
@@ -575,12 +719,13 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // Add function to fetch termins
     function fetchTermins() {
-        fetch(`/api/termins?statistics=${currentStatistics}`)
+        fetch(`/api/termins?statistics=${currentStatistics}&details=true`)
             .then(response => response.json())
             .then(data => {
                 // Update the select options
                 terminSelect.innerHTML = '';
-                data.forEach(termin => {
+                data.forEach(entry => {
+                    const termin = entry.termin;
                     // Clean up the termin value - remove any potential prefix
                     let displayTermin = termin;
                     let valueTermin = termin;
@@ -590,9 +735,15 @@ document.addEventListener('DOMContentLoaded', function() {
                         displayTermin = termin.substring(6); // Remove _EMISO prefix for display
                     }
 
+                    // Show how fresh the termin is, straight from the catalog
+                    if (entry.last_refresh) {
+                        displayTermin += ` · ${entry.row_count} rows · refreshed ${entry.last_refresh.substring(0, 16)}`;
+                    }
+
                     const option = document.createElement('option');
                     option.value = valueTermin;
                     option.textContent = displayTermin;
+                    option.title = `Source watermark: ${entry.source_watermark || '-'}`;
                     terminSelect.appendChild(option);
                 });
                 // Clear the custom termin input
@@ -602,7 +753,7 @@ document.addEventListener('DOMContentLoaded', function() {
                     loadData();
                 } else {
                     // No data for this statistics type
-                    tableBody.innerHTML = `<tr><td colspan="6" class="text-center">No data available for ${currentStatistics.toUpperCase()}. Use the Update Data button to import.</td></tr>`;
+                    tableBody.innerHTML = `<tr><td colspan="7" class="text-center">No data available for ${currentStatistics.toUpperCase()}. Use the Update Data button to import.</td></tr>`;
                     totalRecords.textContent = '0';
                     missingCount.textContent = '0';
                     missingPercentage.textContent = '0%';
@@ -0,0 +1,89 @@
+"""
+Time the streamed /api/export formats against building the whole row list and calling json.dumps.
+
+Run from the repository root: python tests/bench_export.py [rows]
+The termin is written to a bmi_data.db in a temporary directory, the repository's database is not touched.
+Time and peak memory are measured in separate runs, tracemalloc slows the export down.
+"""
+import os
+import sys
+import json
+import random
+import tempfile
+import time
+import tracemalloc
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+import db_utils
+import export
+
+TERMIN = '209701'
+
+
+def record(i, rng):
+    return {'id2': str(i), 'datei': f'BMI_{i:08d}.xml', 'melder_id_bmi': f'M{rng.randint(0, 4999):05d}',
+            'typ': rng.choice(['AB', 'CD', 'EF']), 'erstellt': '2025-04-01 10:00:00', 'import_found': i % 7 != 0}
+
+
+def stream(client, format, gzip):
+    """Read an export chunk by chunk like a client would, returns (bytes sent, lines)"""
+    response = client.get(f'/api/export/{TERMIN}?format={format}', buffered=False,
+                          headers={'Accept-Encoding': 'gzip'} if gzip else {})
+    size = lines = 0
+    decompressor = zlib.decompressobj(31)
+    for chunk in response.response:
+        size += len(chunk)
+        if format != 'parquet':
+            lines += (decompressor.decompress(chunk) if gzip else chunk).count(b'\n')
+    return size, lines
+
+
+def dump_all():
+    """The approach the export replaces: every row as a dict in one list, then one json.dumps"""
+    with db_utils.sqlite_connection('bmi_data.db') as conn:
+        rows = [dict(row) for row in conn.execute(f"SELECT * FROM BMI{TERMIN} ORDER BY datei")]
+        return len(json.dumps(rows))
+
+
+def measure(run):
+    start = time.perf_counter()
+    result = run()
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak, result
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        db_utils.insert_into_bmi_table({str(i): record(i, rng) for i in range(rows)}, 'bmi_data.db', TERMIN, 'wpi')
+        client = app.create_app().test_client()
+        print(f"{rows} rows, sorted by datei")
+
+        formats = [format for format in export.EXPORT_FORMATS if format != 'parquet' or export.pyarrow is not None]
+        for format in formats:
+            for gzip in (False, True):
+                seconds, peak, (size, lines) = measure(lambda: stream(client, format, gzip))
+                print(f"{format + ('+gz' if gzip else ''):10} {seconds:6.2f} s  {size / 1e6:6.2f} MB  "
+                      f"peak {peak / 1e6:5.1f} MB" + (f"  {lines} lines" if lines else ""))
+
+        seconds, peak, size = measure(dump_all)
+        print(f"{'list+json':10} {seconds:6.2f} s  {size / 1e6:6.2f} MB  peak {peak / 1e6:5.1f} MB")
+        # Windows can't delete the directory while the database is open or current
+        for pool in db_utils.sqlite_pools.values():
+            while not pool.empty():
+                pool.get_nowait().close()
+        os.chdir(os.path.dirname(directory))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Compare parse_bmi_html with the BeautifulSoup parser it replaced on a synthetic report page.
+
+Run from the repository root: python tests/bench_parse_bmi.py [rows]
+Time and peak memory are measured in separate runs, tracemalloc slows both parsers down.
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import process_bmi
+from test_parse_bmi import make_report_page, parse_with_beautifulsoup, compared
+
+
+def measure(parse):
+    start = time.perf_counter()
+    parse()
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    parse()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else process_bmi.BMI_LIST_SIZE
+    html = make_report_page(rows)
+    # The streaming parser gets the page the way iter_content delivers it
+    chunks = [html.encode('utf-8')[i:i + process_bmi.STREAM_CHUNK_SIZE]
+              for i in range(0, len(html.encode('utf-8')), process_bmi.STREAM_CHUNK_SIZE)]
+    print(f"{rows} report rows, {len(html) / 1e6:.1f} MB of HTML")
+
+    if compared(process_bmi.parse_bmi_html(chunks)) != parse_with_beautifulsoup(html):
+        sys.exit("The parsers disagree, run pytest tests/test_parse_bmi.py")
+
+    for name, parse in [('BeautifulSoup', lambda: parse_with_beautifulsoup(html)),
+                        ('BmiRowParser', lambda: process_bmi.parse_bmi_html(chunks))]:
+        seconds, peak = measure(parse)
+        print(f"{name:14} {seconds:6.2f} s  peak {peak / 1e6:6.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+import os
+import sys
+import pytest
+
+# The modules live in the repository root, next to app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Run the test in an empty directory, so the modules' bmi_data.db is a fresh database there"""
+    import db_utils
+    import query_cache
+    monkeypatch.chdir(tmp_path)
+    db_utils.sqlite_pools.clear()
+    query_cache.results.clear()
+    yield tmp_path / 'bmi_data.db'
+    for pool in db_utils.sqlite_pools.values():
+        while not pool.empty():
+            pool.get_nowait().close()
+    db_utils.sqlite_pools.clear()
+    query_cache.results.clear()
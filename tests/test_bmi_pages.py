@@ -0,0 +1,79 @@
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+import process_bmi
+
+PAGE_SIZE = 100
+
+
+class StubBmi(BaseHTTPRequestHandler):
+    """MeldungList.do stand-in serving server.total_rows report rows page by page"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        form = urllib.parse.parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        page = 1 if self.server.ignore_page else int(form.get(process_bmi.BMI_PAGE_FIELD, ['1'])[0])
+        size = int(form['value(nlistsize)'][0])
+        rows = ''.join(
+            f'<tr><td><input type="checkbox" value="A{i}##B{i}"></td><td>M{i}</td><td>KI</td><td>202504</td>'
+            f'<td>file_{i}.zip_x</td><td>01.04.2025</td><td>ZIP</td><td></td></tr>'
+            for i in range((page - 1) * size, min(page * size, self.server.total_rows)))
+        body = f'<html><body><table>{rows}</table></body></html>'.encode('utf-8')
+        self.server.pages.append(page)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_bmi():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubBmi)
+    server.total_rows = 0
+    server.ignore_page = False
+    server.pages = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f'http://127.0.0.1:{server.server_port}/'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def fetch(server, max_workers=3):
+    return list(process_bmi.iter_bmi_pages('202504', '14', url=server.url, auth=('user', 'password'),
+                                           max_workers=max_workers, page_size=PAGE_SIZE))
+
+
+@pytest.mark.parametrize('total_rows', [1, 250, 300, 0])
+def test_all_rows_once(stub_bmi, total_rows):
+    # 250 ends with a short page, 300 with a full one followed by an empty page
+    stub_bmi.total_rows = total_rows
+
+    rows = fetch(stub_bmi)
+
+    assert sorted(row['id2'] for row in rows) == sorted(f'B{i}' for i in range(total_rows))
+    assert len(rows) == total_rows
+
+
+def test_server_ignoring_the_page_field_raises(stub_bmi):
+    stub_bmi.total_rows = 1000
+    stub_bmi.ignore_page = True
+
+    with pytest.raises(RuntimeError, match='ignores'):
+        fetch(stub_bmi)
+
+
+def test_max_pages_guard_raises(stub_bmi, monkeypatch):
+    stub_bmi.total_rows = 1000
+    monkeypatch.setattr(process_bmi, 'BMI_MAX_PAGES', 4)
+
+    with pytest.raises(RuntimeError, match='more than 4 pages'):
+        fetch(stub_bmi)
+    assert max(stub_bmi.pages) == 4
+
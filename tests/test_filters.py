@@ -0,0 +1,32 @@
+import pytest
+import app
+import db_utils
+
+
+def record(i):
+    datei = f'Übersicht_{i}.xml' if i % 40 == 0 else f'report_{i}.xml'
+    return {'id2': str(i), 'datei': datei, 'melder_id_bmi': f'M{i:05d}', 'typ': 'AB', 'erstellt': '2025-04-01',
+            'import_found': False}
+
+
+@pytest.fixture
+def client(database):
+    db_utils.insert_into_bmi_table({str(i): record(i) for i in range(200)}, 'bmi_data.db', '202504', 'wpi')
+    db_utils.migrate_bmi_tables('bmi_data.db')
+    return app.app.test_client()
+
+
+# Five of the rows have Übersicht in datei. Values of three characters and more are answered by the
+# trigram index, shorter ones and ones with a LIKE wildcard by LIKE, and both have to fold case alike.
+@pytest.mark.parametrize('value, count', [('übersicht', 5), ('ÜBERSICHT', 5), ('üb', 5), ('ÜB', 5), ('ü', 5),
+                                          ('sicht_4', 1), ('SICHT_4', 1)])
+def test_filter_case_does_not_depend_on_the_path(client, value, count):
+    data = client.get(f'/api/data/202504?statistics=wpi&page_size=500&datei={value}').get_json()['data']
+    assert len(data) == count
+    assert all('übersicht' in row['datei'].lower() for row in data)
+
+
+def test_unselective_filter_falls_back_to_folded_like(client, monkeypatch):
+    monkeypatch.setattr(db_utils, 'BMI_FTS_MAX_SELECTIVITY', 0)
+    data = client.get('/api/data/202504?statistics=wpi&page_size=500&datei=übersicht').get_json()['data']
+    assert len(data) == 5
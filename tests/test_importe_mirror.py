@@ -0,0 +1,27 @@
+import sqlite3
+import db_utils
+import importe_mirror
+import process_data
+
+
+def test_never_synced_mirror_is_not_matched(database, monkeypatch):
+    monkeypatch.setattr(db_utils, 'connect_to_sql_server', lambda db_config, stage='PROD': None)
+
+    assert process_data.load_mirrored_importe({}, 'wpi') is None
+
+
+def test_existing_mirror_is_used_when_the_sync_fails(database, monkeypatch):
+    monkeypatch.setattr(db_utils, 'connect_to_sql_server', lambda db_config, stage='PROD': None)
+    conn = sqlite3.connect(importe_mirror.MIRROR_DB_PATH)
+    importe_mirror.ensure_state_table(conn)
+    conn.execute("CREATE TABLE importe_wpi (datei_id TEXT, empfangszeit TEXT)")
+    conn.execute("INSERT INTO importe_wpi VALUES ('a.xml', '2025-04-01')")
+    # The last sync found no rejected imports, so there is state but no abgewiesen table
+    conn.executemany("INSERT INTO mirror_state (name, watermark) VALUES (?, '2025-04-01')",
+                     [('importe_wpi',), ('abgewiesen_wpi',)])
+    conn.commit()
+    conn.close()
+
+    importe_dict, importe_abgewiesen_dict = process_data.load_mirrored_importe({}, 'wpi')
+    assert list(importe_dict) == ['a.xml']
+    assert importe_abgewiesen_dict == {}
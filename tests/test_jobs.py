@@ -0,0 +1,32 @@
+import app
+import jobs
+import process_bmi
+from test_parse_bmi import make_report_page
+
+
+def test_parse_progress_while_streaming(monkeypatch):
+    data = make_report_page(2500).encode('utf-8')
+    reported = []
+
+    def chunks():
+        for start in range(0, len(data), process_bmi.STREAM_CHUNK_SIZE):
+            # Progress for the rows of a chunk is reported before the next chunk is read
+            reported.append(('chunk', start))
+            yield data[start:start + process_bmi.STREAM_CHUNK_SIZE]
+
+    monkeypatch.setattr(process_bmi, 'fetch_bmi_stream', lambda termin, sachgebiet: (chunks(), 'utf-8'))
+    bmi_dict = process_bmi.get_bmi_data_dict('202504', 'wpi', progress=lambda rows: reported.append(('rows', rows)))
+
+    assert len(bmi_dict) == 2503
+    assert [entry[1] for entry in reported if entry[0] == 'rows'] == [1000, 2000]
+    # The first report arrives while the body is still being read
+    assert any(entry[0] == 'chunk' for entry in reported[reported.index(('rows', 1000)):])
+
+
+def test_job_lookup_does_not_start_the_worker(database, monkeypatch):
+    monkeypatch.setattr(jobs, 'worker_thread', None)
+
+    response = app.app.test_client().get('/api/jobs/unknown')
+
+    assert response.status_code == 404
+    assert jobs.worker_thread is None
@@ -0,0 +1,98 @@
+import pytest
+import requests
+from bs4 import BeautifulSoup
+import process_bmi
+
+# Keys compared between the parsers, last_updated differs by the time of the run
+ROW_KEYS = ('id1', 'id2', 'melder_id_bmi', 'institutstyp', 'termin', 'datei', 'erstellt', 'typ')
+
+# Rows the old parser has to be matched on: a checkbox without a value, unclosed cells,
+# a self-closing checkbox, nested markup in a cell, a wrong cell count and an unclosed row
+MALFORMED_ROWS = '''
+<tr><td><input type=checkbox></td><td>a</td><td>b</td><td>c</td><td>d</td><td>e</td><td>f</td><td>g</td></tr>
+<tr><td><input type="checkbox" value="X##Y"><td>unclosed<td>c<td>d<td>e<td>f<td>g<td>h</tr>
+<tr><td><input type="checkbox" value="P##Q"/></td><td>a</td><td><b>b<i>x</i></b></td><td>c</td><td>d</td><td>e</td><td>f</td><td></td></tr>
+<tr><td><input type="checkbox" value="S##T"></td><td>a</td><td>b</td><td>c</td><td>d</td><td>e</td><td>f</td></tr>
+<tr><td><input type="checkbox" value="U"></td><td>a</td><td>b</td><td>c</td><td>d</td><td>e</td><td>f</td><td>g</td></tr>
+<tr><td><input type="checkbox" value="N1##N2"></td><td>a</td><td>b</td><td>c</td><td>d</td><td>e</td><td>f</td><td>g</td>
+'''
+
+
+def make_report_page(rows):
+    """Build a MeldungList.do page with the report rows inside a layout table, followed by malformed rows"""
+    report_rows = ''.join(
+        f'<tr class="r{i % 2}"><td><input type="checkbox" name="sel" value="A{i}##B{i}"></td>\n'
+        f'<td>  M{i:06d} </td><td>KI</td><td>202504</td>'
+        f'<td><a href="x?i={i}">Übersicht_{i}.zip_abc&amp;d.xml</a></td>'
+        f'<td>01.04.2025 12:00</td><td>ZIP</td><td><img src=x.gif></td></tr>\n'
+        for i in range(rows))
+    return ('<html><body><table><tr><td><table>' + report_rows + '</table></td></tr></table>'
+            '<table>' + MALFORMED_ROWS + '</table></body></html>')
+
+
+def parse_with_beautifulsoup(html):
+    """The BeautifulSoup parser parse_bmi_html replaced, reduced to the compared keys"""
+    bmi_dict = {}
+    soup = BeautifulSoup(html, 'html.parser')
+    for row in soup.find_all('tr'):
+        cells = row.find_all('td')
+        if len(cells) != 8:
+            continue
+        checkbox = cells[0].find('input', type='checkbox')
+        if checkbox and 'value' in checkbox.attrs:
+            ids = checkbox['value'].split('##')
+            if len(ids) == 2:
+                bmi_dict[ids[1]] = {
+                    'id1': ids[0],
+                    'id2': ids[1],
+                    'melder_id_bmi': cells[1].text.strip(),
+                    'institutstyp': cells[2].text.strip(),
+                    'termin': cells[3].text.strip(),
+                    'datei': cells[4].text.strip().replace('.zip_', '.zip - '),
+                    'erstellt': cells[5].text.strip(),
+                    'typ': cells[6].text.strip(),
+                }
+    return bmi_dict
+
+
+def compared(bmi_dict):
+    return {id2: {key: row[key] for key in ROW_KEYS} for id2, row in bmi_dict.items()}
+
+
+def byte_chunks(html, size):
+    data = html.encode('utf-8')
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('chunk_size', [None, 7, 4096])
+def test_parity_with_beautifulsoup(chunk_size):
+    html = make_report_page(200)
+    content = html if chunk_size is None else byte_chunks(html, chunk_size)
+
+    assert compared(process_bmi.parse_bmi_html(content)) == parse_with_beautifulsoup(html)
+
+
+def test_malformed_rows():
+    rows = compared(process_bmi.parse_bmi_html(make_report_page(0)))
+
+    assert sorted(rows) == ['N2', 'Q', 'Y']
+    assert rows['Q']['institutstyp'] == 'bx'
+    assert rows['Y']['melder_id_bmi'] == 'unclosedcdefgh'
+
+
+def test_datei_and_entities():
+    row = process_bmi.parse_bmi_html(byte_chunks(make_report_page(1), 5))['B0']
+
+    assert row['melder_id_bmi'] == 'M000000'
+    assert row['datei'] == 'Übersicht_0.zip - abc&d.xml'
+
+
+def test_broken_stream_raises():
+    data = make_report_page(100).encode('utf-8')
+
+    def chunks():
+        yield data[:len(data) // 2]
+        raise requests.exceptions.ChunkedEncodingError('Connection broken')
+
+    with pytest.raises(requests.RequestException):
+        process_bmi.parse_bmi_html(chunks())
@@ -0,0 +1,24 @@
+import pytest
+import app
+import db_utils
+
+
+def record(id2):
+    return {'id2': id2, 'datei': f'file_{id2}.xml', 'melder_id_bmi': 'M00001', 'typ': 'AB', 'erstellt': '2025-04-01',
+            'import_found': False}
+
+
+@pytest.mark.parametrize('migrate', [False, True])
+def test_helper_tables_are_not_termins(database, migrate):
+    # An incremental sync creates bmi_row_hashes and bmi_changes, both match LIKE 'BMI%'
+    db_utils.insert_into_bmi_table({'1': record('1'), '2': record('2')}, 'bmi_data.db', '202504', 'wpi')
+    db_utils.sync_bmi_table({'1': record('1')}, 'bmi_data.db', '202505', 'wpi')
+    db_utils.sync_bmi_table({'1': record('1')}, 'bmi_data.db', '202504', 'wpi')
+    db_utils.insert_into_bmi_table({'1': record('1')}, 'bmi_data.db', '202504', 'emiso')
+    if migrate:
+        db_utils.migrate_to_entries('bmi_data.db')
+    db_utils.migrate_bmi_tables('bmi_data.db')
+
+    client = app.app.test_client()
+    assert client.get('/api/termins?statistics=wpi').get_json() == ['202505', '202504']
+    assert client.get('/api/termins?statistics=emiso').get_json() == ['202504']
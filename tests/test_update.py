@@ -0,0 +1,26 @@
+import app
+import db_utils
+import jobs
+import process_bmi
+
+
+def record(id2):
+    return {'id2': id2, 'datei': f'file_{id2}.xml', 'melder_id_bmi': 'M00001', 'typ': 'AB', 'erstellt': '2025-04-01',
+            'import_found': False}
+
+
+def test_update_is_paged_once_a_termin_reaches_the_list_cap(database, monkeypatch):
+    monkeypatch.setattr(process_bmi, 'BMI_LIST_SIZE', 3)
+    submitted = []
+    monkeypatch.setattr(jobs, 'submit_refresh',
+                        lambda termin, statistics, options: submitted.append((termin, options)) or ('id', False))
+    db_utils.insert_into_bmi_table({str(i): record(str(i)) for i in range(3)}, 'bmi_data.db', '202504', 'wpi')
+    db_utils.insert_into_bmi_table({str(i): record(str(i)) for i in range(2)}, 'bmi_data.db', '202505', 'wpi')
+    db_utils.migrate_bmi_tables('bmi_data.db')
+    client = app.app.test_client()
+
+    for body in [{'termin': '202504'}, {'termin': '202505'}, {'termin': '202606'},
+                 {'termin': '202504', 'paged': False}, {'termin': '202505', 'paged': True}]:
+        assert client.post('/api/update', json=body).get_json()['success']
+
+    assert [options['paged'] for _, options in submitted] == [True, False, False, False, True]